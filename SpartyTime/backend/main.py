@@ -1,4 +1,4 @@
-import os, aiohttp
+import os
 from contextlib import asynccontextmanager
 
 from dotenv import find_dotenv, load_dotenv
@@ -15,36 +15,55 @@ from .utils.database_handler import (
     create_party_db,
     create_user_db,
     delete_parties,
+    ensure_indexes,
+    get_live_sync_workers,
     open_db,
     get_party_instance,
     get_party_user_pfps,
 )
-from .utils.party_handler import (
-    add_new_parties,
-    check_for_inactivity,
-    update_party_details,
-    update_party_genre,
-    update_playback,
-)
-from .utils.spotify_handler import close_session, create_session, update_user_genre
+from .utils.discovery_service import list_parties, match_parties
+from .utils.lease_manager import LEASE_TTL, lease_manager
+from .utils.party_registry import currently_listening
+from .utils.party_scheduler import party_scheduler
+from .utils.spotify_handler import close_session, create_session
+from .utils.token_manager import token_manager
+from .utils.write_buffer import write_buffer
 
 load_dotenv(find_dotenv())
 
 
+def leased_party_users() -> set[str]:
+    """Gets the owners and members of the parties leased by this worker."""
+    users = set()
+    for party_id, record in currently_listening.items():
+        if lease_manager.owns(party_id):
+            users.add(record.owner)
+            users.update(record.users)
+    return users
+
+
 @asynccontextmanager
 async def lifespan(app: FastAPI):
 
     await open_db()
+    await ensure_indexes()
     await create_session()
-    await add_new_parties()
-    await check_for_inactivity()
-    await update_party_details()
-    await update_playback()
-    await update_user_genre(all=True)
-    await update_party_genre()
+    await write_buffer.start()
+    await token_manager.start(leased_party_users)
+    await currently_listening.start()
+    await lease_manager.start(currently_listening.keys)
+    await party_scheduler.start()
     yield
 
-    await delete_parties()
+    await party_scheduler.stop()
+    await lease_manager.stop()
+    await currently_listening.stop()
+    await token_manager.stop()
+    await write_buffer.stop()
+    # Parties are only cleared once the last sync worker shuts down, the others
+    # take over the leases of this one.
+    if not await get_live_sync_workers(LEASE_TTL):
+        await delete_parties()
     await close_db()
     await close_session()  # pyright: ignore
 
@@ -80,21 +99,13 @@ for router in routers:
 
 @app.get("/", response_class=HTMLResponse)
 async def home(request: Request):
-    async with aiohttp.ClientSession() as session:
-        if request.session.get("user_id"):
-            print(request.session.get("user_id"))
-            async with session.get(
-                str(request.url_for("match_genres")), headers=request.headers
-            ) as resp:
-                parties = await resp.json()
-        else:
-            async with session.get(str(request.url_for("get_all_parties"))) as resp:
-                print(resp.status)
-                parties = await resp.json()
-    print(parties)
-    print(type(parties))
+    user_id = request.session.get("user_id")
+    if user_id:
+        parties = await match_parties(user_id, 5)
+    else:
+        parties = await list_parties(5)
     return templates.TemplateResponse(
-        "index.html", {"request": request, "parties": parties["parties"][:5]}
+        "index.html", {"request": request, "parties": parties["parties"]}
     )
 
 
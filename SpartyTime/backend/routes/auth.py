@@ -1,9 +1,9 @@
 import base64
 import logging
 import os
+import time
 import urllib.parse
 
-import aiohttp
 import six
 from dotenv import find_dotenv, load_dotenv
 from fastapi import APIRouter, Request, status
@@ -11,7 +11,9 @@ from fastapi.responses import JSONResponse, RedirectResponse
 
 from ..utils.database_handler import create_user, get_user_by_id
 from ..utils.logger_handler import LoggerFormatter
+from ..utils.spotify_client import spotify_client
 from ..utils.spotify_handler import get_spotify_details, update_user_genre
+from ..utils.token_manager import token_manager
 
 load_dotenv(find_dotenv())
 
@@ -45,20 +47,22 @@ async def callback(request: Request, code: str):
     auth_header = base64.b64encode(
         six.text_type(SPOTIFY_CLIENT_ID + ":" + SPOTIFY_CLIENT_SECRET).encode("ascii")
     )
-    async with aiohttp.ClientSession() as session:
-        async with session.post(
-            "https://accounts.spotify.com/api/token",
-            headers={
-                "Authorization": f"Basic {auth_header.decode('ascii')}",
-                "Content-Type": "application/x-www-form-urlencoded",
-            },
-            data={
-                "redirect_uri": f"{REDIRECT_URL}",
-                "code": code,
-                "grant_type": "authorization_code",
-            },
-        ) as resp:
-            dat = await resp.json()
+    async with spotify_client.request(
+        "POST",
+        "https://accounts.spotify.com/api/token",
+        headers={
+            "Authorization": f"Basic {auth_header.decode('ascii')}",
+            "Content-Type": "application/x-www-form-urlencoded",
+        },
+        data={
+            "redirect_uri": f"{REDIRECT_URL}",
+            "code": code,
+            "grant_type": "authorization_code",
+        },
+    ) as resp:
+        dat = await resp.json()
+    if "expires_in" in dat:
+        dat["expires_at"] = round(time.time()) + dat["expires_in"]
     try:
         user_data = await get_spotify_details(dat["access_token"])
 
@@ -77,7 +81,7 @@ async def callback(request: Request, code: str):
     user = await get_user_by_id(user_data["id"], is_spotify_id=True)
 
     request.session["user_id"] = str(user.id)
-    await update_user_genre(str(user.id))
+    await update_user_genre(str(user.id), all=False)
     return RedirectResponse(
         str(request.url_for("home")), status_code=status.HTTP_302_FOUND
     )
@@ -91,8 +95,7 @@ async def me(request: Request):
         token = request.cookies.get("session")
         if token:
             user_id = request.session["user_id"]
-            user = await get_user_by_id(user_id)
-            access_token = user.spotify_session_data.access_token
+            access_token = await token_manager.get_token(user_id)
             user_data = await get_spotify_details(access_token)
 
             return JSONResponse(content=user_data)
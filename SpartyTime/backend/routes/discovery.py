@@ -1,8 +1,8 @@
-from bson.objectid import ObjectId
-from fastapi import APIRouter, Depends, Request, status
+from fastapi import APIRouter, Depends, HTTPException, Query, Request, status
 from fastapi.responses import JSONResponse
 
-from ..utils.database_handler import aggregate_party, get_parties, get_user_by_id
+from ..utils.discovery_service import list_parties, match_parties
+from ..utils.pagination import InvalidCursor
 from ..utils.session_manager import validate_session
 
 router = APIRouter(
@@ -11,70 +11,50 @@ router = APIRouter(
 )
 
 
-async def convert_bsons_to_str(data: list) -> list:
-    """Converts BSON object ids to strings"""
-    for item in data:
-        item.id = str(item.id)
-        item.party_info.owner = str(item.party_info.owner)
-        item.party_info.users = [str(user) for user in item.party_info.users]
-    return [i.model_dump() for i in data]
+def invalid_cursor() -> HTTPException:
+    """Builds the error returned for a malformed cursor."""
+    return HTTPException(
+        status_code=status.HTTP_400_BAD_REQUEST, detail=f"Invalid cursor."
+    )
 
 
 @router.get("/parties")
-async def get_all_parties(request: Request) -> JSONResponse:
+async def get_all_parties(
+    request: Request, limit: int = Query(20, ge=1, le=100), cursor: str = None
+) -> JSONResponse:
     """API endpoint to get all parties"""
-    parties = await get_parties()
-
-    return JSONResponse(
-        content={"parties": await convert_bsons_to_str(parties)},
-        status_code=status.HTTP_200_OK,
-    )
+    try:
+        page = await list_parties(limit, cursor)
+    except InvalidCursor:
+        raise invalid_cursor()
+    return JSONResponse(content=page, status_code=status.HTTP_200_OK)
 
 
 @router.get("/parties/{genre}")
-async def get_parties_by_genre(request: Request, genre: str) -> JSONResponse:
+async def get_parties_by_genre(
+    request: Request,
+    genre: str,
+    limit: int = Query(20, ge=1, le=100),
+    cursor: str = None,
+) -> JSONResponse:
     """API endpoint to get parties by genre"""
-    parties = await get_parties({"party_info.genres": genre})
-
-    return JSONResponse(
-        content={"parties": await convert_bsons_to_str(parties)},
-        status_code=status.HTTP_200_OK,
-    )
+    try:
+        page = await list_parties(limit, cursor, genre)
+    except InvalidCursor:
+        raise invalid_cursor()
+    return JSONResponse(content=page, status_code=status.HTTP_200_OK)
 
 
 @router.get(
     "/match-user",
     dependencies=[Depends(validate_session)],
 )
-async def match_genres(request: Request) -> JSONResponse:
+async def match_genres(
+    request: Request, limit: int = Query(20, ge=1, le=100), cursor: str = None
+) -> JSONResponse:
     """API endpoint to match user genres with party genres and return parties with highest intersection"""
-    userid = request.session["user_id"]
-    user = await get_user_by_id(userid)
-    user_genres = user.genres
-    parties = await aggregate_party(
-        [
-            {
-                "$match": {
-                    "party_info.genres": {"$in": user_genres},
-                    "party_info.users": {"$nin": [ObjectId(userid)]},
-                    "party_info.type": "public",
-                }
-            },
-            {
-                "$project": {
-                    "party_info": 1,
-                    "party_data": 1,
-                    "intersection": {
-                        "$size": {
-                            "$setIntersection": ["$party_info.genres", user_genres]
-                        }
-                    },
-                }
-            },
-            {"$sort": {"intersection": -1}},
-        ]
-    )
-    return JSONResponse(
-        content={"parties": await convert_bsons_to_str(parties)},
-        status_code=status.HTTP_200_OK,
-    )
+    try:
+        page = await match_parties(request.session["user_id"], limit, cursor)
+    except InvalidCursor:
+        raise invalid_cursor()
+    return JSONResponse(content=page, status_code=status.HTTP_200_OK)
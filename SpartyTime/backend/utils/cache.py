@@ -0,0 +1,118 @@
+import asyncio
+import time
+from collections import OrderedDict
+from typing import Awaitable, Callable
+
+_MISSING = object()
+
+
+class TTLCache:
+    """Bounded in-process cache with per-entry TTL and LRU eviction."""
+
+    def __init__(self, maxsize: int, ttl: float):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._entries: OrderedDict = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def __contains__(self, key) -> bool:
+        return self.get(key, _MISSING, count=False) is not _MISSING
+
+    def get(self, key, default=None, count: bool = True):
+        """Get a live entry, counting the lookup as a hit or a miss."""
+        entry = self._entries.get(key)
+        if entry is not None and entry[0] > time.monotonic():
+            self._entries.move_to_end(key)
+            if count:
+                self.hits += 1
+            return entry[1]
+        if entry is not None:
+            del self._entries[key]
+        if count:
+            self.misses += 1
+        return default
+
+    def set(self, key, value, ttl: float = None) -> None:
+        """Store an entry, evicting the least recently used one when full."""
+        self._entries[key] = (
+            time.monotonic() + (self.ttl if ttl is None else ttl),
+            value,
+        )
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+
+    def pop(self, key, default=None):
+        """Remove an entry."""
+        entry = self._entries.pop(key, None)
+        return default if entry is None else entry[1]
+
+    def clear(self) -> None:
+        """Remove every entry."""
+        self._entries.clear()
+
+    def stats(self) -> dict:
+        """Get the size and hit rate of the cache."""
+        lookups = self.hits + self.misses
+        return {
+            "size": len(self._entries),
+            "maxsize": self.maxsize,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+        }
+
+
+class SingleFlight:
+    """Shares one call between concurrent callers asking for the same key.
+
+    With a ttl the result is also reused by callers arriving shortly after the
+    call finished.
+    """
+
+    def __init__(self, ttl: float = 0, maxsize: int = 1024):
+        self.calls = 0
+        self.coalesced = 0
+        self._in_flight: dict[object, asyncio.Task] = {}
+        self._results = TTLCache(maxsize, ttl) if ttl else None
+
+    async def run(self, key, func: Callable[[], Awaitable]):
+        """Run func for key unless an identical call is in flight or cached."""
+        self.calls += 1
+        if self._results is not None:
+            result = self._results.get(key, _MISSING)
+            if result is not _MISSING:
+                return result
+
+        task = self._in_flight.get(key)
+        if task:
+            self.coalesced += 1
+        else:
+            task = asyncio.ensure_future(func())
+            self._in_flight[key] = task
+            task.add_done_callback(lambda _: self._done(key, task))
+        return await asyncio.shield(task)
+
+    def _done(self, key, task: asyncio.Task) -> None:
+        if self._in_flight.get(key) is task:
+            del self._in_flight[key]
+        if (
+            self._results is not None
+            and not task.cancelled()
+            and task.exception() is None
+        ):
+            self._results.set(key, task.result())
+
+    def stats(self) -> dict:
+        """Get how many calls were made and how many were saved."""
+        cache_hits = self._results.hits if self._results is not None else 0
+        return {
+            "calls": self.calls,
+            "coalesced": self.coalesced,
+            "cache_hits": cache_hits,
+            "saved": self.coalesced + cache_hits,
+        }
@@ -1,16 +1,29 @@
 import os
+import time
 
 import pydantic
 from bson.objectid import ObjectId
 from dotenv import find_dotenv, load_dotenv
 from motor.motor_asyncio import AsyncIOMotorClient
-from pymongo import errors
+from pymongo import UpdateOne, errors
+
+from .cache import TTLCache
+from .index_manager import build_indexes, uses_index
+from .write_buffer import write_buffer
 
 load_dotenv(find_dotenv())
 
 connection_str = os.environ["MONGODB_CONNECTION_STR"]
 client = None
 
+USER_CACHE_ENABLED = os.environ.get("USER_CACHE_ENABLED", "true").lower() == "true"
+USER_CACHE_SIZE = int(os.environ.get("USER_CACHE_SIZE", 10000))
+USER_CACHE_TTL = float(os.environ.get("USER_CACHE_TTL", 60))
+
+user_cache = TTLCache(USER_CACHE_SIZE, USER_CACHE_TTL)
+spotify_user_ids = TTLCache(USER_CACHE_SIZE, USER_CACHE_TTL)
+user_cache_invalidations = 0
+
 
 async def open_db():
     global client, users_db, parties_db
@@ -23,6 +36,11 @@ async def close_db():
     client.close()  # pyright: ignore
 
 
+async def ensure_indexes() -> dict[str, str]:
+    """Builds the indexes declared by the query functions that are missing."""
+    return await build_indexes(client)
+
+
 def convert_to_bson_id(bson_id: str) -> ObjectId:
     """Converts a string to a BSON object id."""
     return ObjectId(bson_id)
@@ -42,12 +60,14 @@ class SpotifySessionModel(pydantic.BaseModel):
     scope: str
     refresh_token: str
     expires_in: int
+    expires_at: int = 0
 
 
 class UserModel(pydantic.BaseModel):
     id: ObjectId
     username: str
     genres: list[str] = []
+    genre_weights: dict[str, float] = {}
     spotify_id: str
     spotify_data: dict
     spotify_session_data: SpotifySessionModel
@@ -130,6 +150,49 @@ class PartyDataModel(pydantic.BaseModel):
     history: list[dict]
 
 
+def prepended_items(old: list, new: list) -> list | None:
+    """Gets the items prepended to old to make new if new is old shifted by a few items."""
+    for i in range(1, len(new)):
+        if new[i:] == old[: len(new) - i]:
+            return new[:i]
+    return None
+
+
+def diff_documents(old: dict, new: dict, prefix: str = "", update: dict = None) -> dict:
+    """Computes the minimal update turning old into new.
+
+    Nested dicts are compared field by field, history lists that only gained items
+    at the front become a $push and everything else that changed is $set or $unset.
+    """
+    update = {} if update is None else update
+    for key, value in new.items():
+        path = f"{prefix}{key}"
+        if key not in old:
+            update.setdefault("$set", {})[path] = value
+        elif isinstance(value, dict) and isinstance(old[key], dict):
+            diff_documents(old[key], value, f"{path}.", update)
+        elif value != old[key]:
+            pushed = None
+            if (
+                key == "history"
+                and isinstance(value, list)
+                and isinstance(old[key], list)
+            ):
+                pushed = prepended_items(old[key], value)
+            if pushed:
+                update.setdefault("$push", {})[path] = {
+                    "$each": pushed,
+                    "$position": 0,
+                    "$slice": len(value),
+                }
+            else:
+                update.setdefault("$set", {})[path] = value
+    if prefix:
+        for key in old.keys() - new.keys():
+            update.setdefault("$unset", {})[f"{prefix}{key}"] = ""
+    return update
+
+
 class PartyModel(pydantic.BaseModel):
     id: ObjectId
     party_info: PartyInfoModel
@@ -137,6 +200,44 @@ class PartyModel(pydantic.BaseModel):
 
     model_config = {"arbitrary_types_allowed": True}
 
+    _persisted: dict = pydantic.PrivateAttr(default_factory=dict)
+
+    def mark_persisted(self) -> None:
+        """Remembers the current state as the state stored in the database."""
+        self._persisted = self.model_dump(exclude={"id"})
+
+    def changes(self) -> dict:
+        """Computes the update needed to persist the changes since the last save."""
+        return diff_documents(self._persisted, self.model_dump(exclude={"id"}))
+
+
+class PartySummaryInfoModel(pydantic.BaseModel):
+    party_name: str
+    party_description: str
+    genres: list[str] = []
+    type: str
+
+
+class PartySummaryDataModel(pydantic.BaseModel):
+    is_playing: bool = False
+    current_song: dict = {}
+
+
+class PartySummaryModel(pydantic.BaseModel):
+    id: str
+    party_info: PartySummaryInfoModel
+    party_data: PartySummaryDataModel | None = None
+
+
+PARTY_SUMMARY_PROJECTION = {
+    "party_info.party_name": 1,
+    "party_info.party_description": 1,
+    "party_info.genres": 1,
+    "party_info.type": 1,
+    "party_data.is_playing": 1,
+    "party_data.current_song": 1,
+}
+
 
 async def create_party_db() -> None:
     """Creates the party database and collection."""
@@ -235,15 +336,50 @@ async def create_party_db() -> None:
     await parties_db.command("collMod", "party_details", validator=party_validator)
 
 
+@uses_index(
+    "users", "auth_details", [("spotify_id", 1)], {"spotify_id": ""}, unique=True
+)
 async def get_user_by_id(_id: str, is_spotify_id=False) -> UserModel:
-    """Gets a user by their id."""
-    query = {"spotify_id": _id} if is_spotify_id else {"_id": convert_to_bson_id(_id)}
+    """Gets a user by their id.
+
+    Users are served from the read-through user cache, so the returned model
+    must not be modified.
+    """
+    if is_spotify_id:
+        user_id = spotify_user_ids.get(_id) if USER_CACHE_ENABLED else None
+        query = {"_id": user_id} if user_id else {"spotify_id": _id}
+    else:
+        user_id = convert_to_bson_id(_id)
+        query = {"_id": user_id}
+
+    if USER_CACHE_ENABLED and user_id:
+        user = user_cache.get(user_id)
+        if user:
+            return user
+
+    invalidations = user_cache_invalidations
     op = await users_db.auth_details.find_one(query)
 
     if not op:
         raise ValueError(f"User with id {_id} not found. ")
     op = switch_id_to_pydantic(op)
-    return UserModel(**op)
+    user = UserModel(**op)
+    if USER_CACHE_ENABLED and invalidations == user_cache_invalidations:
+        user_cache.set(user.id, user)
+        spotify_user_ids.set(user.spotify_id, user.id)
+    return user
+
+
+def invalidate_user(user_id: str) -> None:
+    """Drops a user from the user cache after it was written to."""
+    global user_cache_invalidations
+    user_cache_invalidations += 1
+    user_cache.pop(convert_to_bson_id(user_id))
+
+
+def user_cache_stats() -> dict:
+    """Gets the size and hit rate of the user cache."""
+    return {"enabled": USER_CACHE_ENABLED, **user_cache.stats()}
 
 
 async def create_user(spotify_dict: dict, spotify_session_dict: dict) -> bool:
@@ -271,6 +407,7 @@ async def update_session(user_id: str, session_data: dict) -> bool:
             {"_id": convert_to_bson_id(user_id)},
             {"$set": {"spotify_session_data": session_data}},
         )
+        invalidate_user(user_id)
         return True
     except Exception:
         return False
@@ -283,6 +420,7 @@ async def update_user(user_id: str, user_data: dict) -> bool:
             {"_id": convert_to_bson_id(user_id)},
             {"$set": user_data},
         )
+        invalidate_user(user_id)
         return True
     except Exception:
         return False
@@ -295,11 +433,18 @@ async def set_user_party(user_id: str, party_id: str) -> bool:
             {"_id": convert_to_bson_id(user_id)},
             {"$set": {"current_party_id": party_id}},
         )
+        invalidate_user(user_id)
         return True
     except Exception:
         return False
 
 
+@uses_index(
+    "users",
+    "auth_details",
+    [("spotify_session_data.access_token", 1)],
+    {"spotify_session_data.access_token": ""},
+)
 async def get_user_by_access_token(access_token: str):
     """Gets a user by their access token."""
     query = {"spotify_session_data.access_token": access_token}
@@ -325,9 +470,14 @@ async def get_party_instance(party_id: str) -> PartyModel:
     if not op:
         raise ValueError(f"Party with id {party_id} not found")
     op = switch_id_to_pydantic(op)
-    return PartyModel(**op)
+    party = PartyModel(**op)
+    party.mark_persisted()
+    return party
 
 
+@uses_index(
+    "parties", "party_details", [("party_info.owner", 1)], {"party_info.owner": ""}
+)
 async def get_party_instance_by_owner(owner_id: str) -> PartyModel:
     """Gets a party instance by its owner."""
     query = {"party_info.owner": owner_id}
@@ -336,7 +486,9 @@ async def get_party_instance_by_owner(owner_id: str) -> PartyModel:
     if not op:
         raise ValueError(f"Party with owner id {owner_id} not found. ")
     op = switch_id_to_pydantic(op)
-    return PartyModel(**op)
+    party = PartyModel(**op)
+    party.mark_persisted()
+    return party
 
 
 async def update_party_instance(
@@ -356,14 +508,48 @@ async def update_party_instance(
 async def remove_party_member(party_id: str, user_id: str) -> bool:
     """Removes a user from a party."""
     await parties_db.party_details.update_one(
-        {"_id": convert_to_bson_id(party_id)}, {"$pull": {"party_info.users": user_id}}
+        {"_id": convert_to_bson_id(party_id)},
+        {"$pull": {"party_info.users": convert_to_bson_id(user_id)}},
     )
     await users_db.auth_details.update_one(
         {"_id": convert_to_bson_id(user_id)}, {"$set": {"current_party_id": "None"}}
     )
+    invalidate_user(user_id)
+    return True
+
+
+def queue_party_changes(party: PartyModel) -> bool:
+    """Buffers the changed fields of a party for the next bulk write.
+
+    Returns False without buffering anything if nothing changed.
+    """
+    update = party.changes()
+    if not update:
+        return False
+    write_buffer.add(parties_db.party_details, UpdateOne({"_id": party.id}, update))
+    party.mark_persisted()
     return True
 
 
+def queue_remove_party_member(party_id: str, user_id: str) -> None:
+    """Buffers removing a user from a party for the next bulk write."""
+    write_buffer.add(
+        parties_db.party_details,
+        UpdateOne(
+            {"_id": convert_to_bson_id(party_id)},
+            {"$pull": {"party_info.users": convert_to_bson_id(user_id)}},
+        ),
+    )
+    write_buffer.add(
+        users_db.auth_details,
+        UpdateOne(
+            {"_id": convert_to_bson_id(user_id)},
+            {"$set": {"current_party_id": "None"}},
+        ),
+        on_flush=lambda: invalidate_user(user_id),
+    )
+
+
 async def delete_party_instance(party_id: str) -> bool:
     """Deletes a party instance from the database."""
     await parties_db.party_details.delete_one({"_id": convert_to_bson_id(party_id)})
@@ -373,8 +559,39 @@ async def delete_party_instance(party_id: str) -> bool:
 async def get_parties(filter_dict: dict = {}) -> list[PartyModel]:
     """Gets all parties from the database."""
     op = parties_db.party_details.find(filter_dict)
-    op = [switch_id_to_pydantic(i) async for i in op]
-    return [PartyModel(**i) for i in op]
+    op = [PartyModel(**switch_id_to_pydantic(i)) async for i in op]
+    for party in op:
+        party.mark_persisted()
+    return op
+
+
+def summary_from_document(document: dict) -> PartySummaryModel:
+    """Builds a party summary from a projected party document."""
+    document["id"] = str(document.pop("_id"))
+    return PartySummaryModel(**document)
+
+
+@uses_index(
+    "parties",
+    "party_details",
+    [("party_info.genres", 1), ("_id", 1)],
+    {"party_info.genres": ""},
+)
+async def get_party_summaries(
+    filter_dict: dict = {}, limit: int = 0, after: str = None
+) -> list[PartySummaryModel]:
+    """Gets the listing fields of parties in id order, without their queue and history.
+
+    Passing the id of the last party of a page as after returns the next page.
+    """
+    if after:
+        filter_dict = {**filter_dict, "_id": {"$gt": convert_to_bson_id(after)}}
+    op = (
+        parties_db.party_details.find(filter_dict, PARTY_SUMMARY_PROJECTION)
+        .sort("_id", 1)
+        .limit(limit)
+    )
+    return [summary_from_document(i) async for i in op]
 
 
 async def delete_parties() -> bool:
@@ -390,19 +607,133 @@ async def get_users(filter_dict: dict = {}) -> list:
     return [UserModel(**i) for i in op]
 
 
-async def aggregate_party(filter_dict: list) -> list:
-    """Aggregates parties based on a filter."""
-    op = parties_db.party_details.aggregate(filter_dict)
-    op = [switch_id_to_pydantic(i) async for i in op]
-    return [PartyModel(**i) for i in op]
+async def get_users_by_ids(user_ids: list, fields: list[str]) -> dict[str, dict]:
+    """Gets the given fields of several users in one query, keyed by user id."""
+    op = users_db.auth_details.find(
+        {"_id": {"$in": [convert_to_bson_id(str(i)) for i in set(user_ids)]}},
+        {field: 1 for field in fields},
+    )
+    return {str(i["_id"]): i async for i in op}
 
 
 async def get_party_user_pfps(party_id: str) -> list:
     """Gets the profile pictures of all users in a party."""
     party = await get_party_instance(party_id)
-    users = party.party_info.users + [party.party_info.owner]
-    user_pfps = []
-    for user in users:
-        user = await get_user_by_id(str(user))
-        user_pfps.append(user.spotify_data["images"][0]["url"])
-    return user_pfps
+    users = [str(i) for i in party.party_info.users + [party.party_info.owner]]
+    found = await get_users_by_ids(users, ["spotify_data.images"])
+    return [found[user]["spotify_data"]["images"][0]["url"] for user in users]
+
+
+async def heartbeat_sync_worker(worker_id: str) -> bool:
+    """Records a heartbeat for a party sync worker."""
+    await parties_db.sync_workers.update_one(
+        {"_id": worker_id}, {"$set": {"heartbeat_at": time.time()}}, upsert=True
+    )
+    return True
+
+
+async def get_live_sync_workers(ttl: float) -> list[str]:
+    """Gets the ids of sync workers that sent a heartbeat in the last ttl seconds."""
+    op = parties_db.sync_workers.find({"heartbeat_at": {"$gte": time.time() - ttl}})
+    return [i["_id"] async for i in op]
+
+
+async def remove_sync_worker(worker_id: str) -> bool:
+    """Removes a sync worker and releases all of its party leases."""
+    await parties_db.sync_workers.delete_one({"_id": worker_id})
+    await parties_db.sync_leases.delete_many({"owner": worker_id})
+    return True
+
+
+async def acquire_party_lease(party_id: str, worker_id: str, ttl: float) -> bool:
+    """Acquires or renews the sync lease of a party.
+
+    Succeeds if the lease is free, expired or already held by the worker.
+    """
+    now = time.time()
+    try:
+        await parties_db.sync_leases.find_one_and_update(
+            {
+                "_id": party_id,
+                "$or": [{"owner": worker_id}, {"expires_at": {"$lt": now}}],
+            },
+            {"$set": {"owner": worker_id, "expires_at": now + ttl}},
+            upsert=True,
+        )
+        return True
+    except errors.DuplicateKeyError:
+        return False
+
+
+async def renew_party_leases(party_ids: list, worker_id: str, ttl: float) -> set:
+    """Renews the sync leases a worker holds with a single write.
+
+    Returns the ids of the leases that are still held by the worker.
+    """
+    result = await parties_db.sync_leases.update_many(
+        {"_id": {"$in": party_ids}, "owner": worker_id},
+        {"$set": {"expires_at": time.time() + ttl}},
+    )
+    if result.matched_count == len(party_ids):
+        return set(party_ids)
+    op = parties_db.sync_leases.find(
+        {"_id": {"$in": party_ids}, "owner": worker_id}, {"_id": 1}
+    )
+    return {i["_id"] async for i in op}
+
+
+async def release_party_lease(party_id: str, worker_id: str) -> bool:
+    """Releases the sync lease of a party if it is held by the worker."""
+    await parties_db.sync_leases.delete_one({"_id": party_id, "owner": worker_id})
+    return True
+
+
+PARTY_REGISTRY_PROJECTION = {
+    "party_info.owner": 1,
+    "party_info.users": 1,
+    "party_info.type": 1,
+    "party_info.genres": 1,
+}
+
+
+async def get_party_registry_documents() -> list[dict]:
+    """Gets the owner, members, type and genres of every party."""
+    op = parties_db.party_details.find({}, PARTY_REGISTRY_PROJECTION)
+    return [i async for i in op]
+
+
+def watch_party_changes():
+    """Opens a change stream on the parties collection.
+
+    Only inserts, replaces, deletes and updates touching party_info are reported,
+    with the full document trimmed to the fields of PARTY_REGISTRY_PROJECTION.
+    """
+    updated_party_info = {
+        "$filter": {
+            "input": {
+                "$objectToArray": {"$ifNull": ["$updateDescription.updatedFields", {}]}
+            },
+            "cond": {"$eq": [{"$substrCP": ["$$this.k", 0, 10]}, "party_info"]},
+        }
+    }
+    pipeline = [
+        {
+            "$match": {
+                "$expr": {
+                    "$or": [
+                        {"$ne": ["$operationType", "update"]},
+                        {"$gt": [{"$size": updated_party_info}, 0]},
+                    ]
+                }
+            }
+        },
+        {
+            "$project": {
+                "operationType": 1,
+                "documentKey": 1,
+                "fullDocument._id": 1,
+                **{f"fullDocument.{k}": 1 for k in PARTY_REGISTRY_PROJECTION},
+            }
+        },
+    ]
+    return parties_db.party_details.watch(pipeline, full_document="updateLookup")
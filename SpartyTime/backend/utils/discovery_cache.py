@@ -0,0 +1,75 @@
+import os
+
+from dotenv import find_dotenv, load_dotenv
+
+from ..utils.cache import TTLCache
+from ..utils.party_registry import PartyRecord, currently_listening
+
+load_dotenv(find_dotenv())
+
+DISCOVERY_CACHE_SIZE = int(os.environ.get("DISCOVERY_CACHE_SIZE", 10000))
+DISCOVERY_CACHE_TTL = float(os.environ.get("DISCOVERY_CACHE_TTL", 30))
+
+# user id -> {(limit, cursor): ranked (party_id, score) pairs}
+match_cache = TTLCache(DISCOVERY_CACHE_SIZE, DISCOVERY_CACHE_TTL)
+
+
+def get_cached_matches(user_id: str, limit: int, cursor: str | None) -> list | None:
+    """Get a cached page of ranked matches for a user."""
+    pages = match_cache.get(user_id, count=False)
+    matches = pages.get((limit, cursor)) if pages is not None else None
+    if matches is None:
+        match_cache.misses += 1
+    else:
+        match_cache.hits += 1
+    return matches
+
+
+def cache_matches(user_id: str, limit: int, cursor: str | None, matches: list) -> None:
+    """Cache a page of ranked matches for a user.
+
+    Pages of a user expire together, DISCOVERY_CACHE_TTL after the first one.
+    """
+    pages = match_cache.get(user_id, count=False)
+    if pages is None:
+        pages = {}
+        match_cache.set(user_id, pages)
+    pages[(limit, cursor)] = matches
+
+
+def invalidate_user_matches(user_id: str) -> None:
+    """Drop the cached matches of a user whose genres or parties changed."""
+    match_cache.pop(str(user_id))
+
+
+def invalidate_matches() -> None:
+    """Drop every cached match after a party was created, retagged or deleted."""
+    match_cache.clear()
+
+
+def invalidate_party_change(
+    party_id: str, previous: PartyRecord | None, record: PartyRecord | None
+) -> None:
+    """Drop the cached matches a party registry change can affect.
+
+    Membership changes only affect the users who joined or left, anything else
+    can change the ranking of every user.
+    """
+    if (
+        previous is None
+        or record is None
+        or previous.type != record.type
+        or previous.genres != record.genres
+    ):
+        invalidate_matches()
+        return
+    for user_id in set(previous.users) ^ set(record.users):
+        invalidate_user_matches(user_id)
+
+
+def discovery_cache_stats() -> dict:
+    """Get the size and hit rate of the discovery cache."""
+    return match_cache.stats()
+
+
+currently_listening.add_listener(invalidate_party_change)
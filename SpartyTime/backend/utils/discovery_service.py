@@ -0,0 +1,74 @@
+from bson.objectid import ObjectId
+
+from ..utils.database_handler import get_party_summaries, get_user_by_id
+from ..utils.discovery_cache import cache_matches, get_cached_matches
+from ..utils.genre_index import genre_index, rank_weights
+from ..utils.pagination import InvalidCursor, decode_cursor, encode_cursor
+
+
+async def list_parties(limit: int, cursor: str = None, genre: str = None) -> dict:
+    """Gets a page of parties in id order and the cursor of the page after it.
+
+    Raises InvalidCursor if the cursor is malformed.
+    """
+    position = decode_cursor(cursor) if cursor else None
+    if position and not (
+        len(position) == 1
+        and isinstance(position[0], str)
+        and ObjectId.is_valid(position[0])
+    ):
+        raise InvalidCursor(f"Invalid cursor {cursor}")
+
+    parties = await get_party_summaries(
+        {"party_info.genres": genre} if genre else {},
+        limit=limit + 1,
+        after=position[0] if position else None,
+    )
+    return {
+        "parties": [i.model_dump() for i in parties[:limit]],
+        "next_cursor": (
+            encode_cursor([parties[limit - 1].id]) if len(parties) > limit else None
+        ),
+    }
+
+
+async def match_parties(user_id: str, limit: int, cursor: str = None) -> dict:
+    """Gets a page of the public parties best matching a user's genres.
+
+    Raises InvalidCursor if the cursor is malformed.
+    """
+    position = decode_cursor(cursor) if cursor else None
+    if position and not (
+        len(position) == 2
+        and isinstance(position[0], str)
+        and isinstance(position[1], (int, float))
+    ):
+        raise InvalidCursor(f"Invalid cursor {cursor}")
+
+    ranked = get_cached_matches(user_id, limit, cursor)
+    if ranked is None:
+        user = await get_user_by_id(user_id)
+        ranked = genre_index.match(
+            user.genre_weights or rank_weights(user.genres),
+            user_id,
+            limit=limit + 1,
+            after=tuple(position) if position else None,
+        )
+        cache_matches(user_id, limit, cursor, ranked)
+
+    parties = {
+        i.id: i
+        for i in await get_party_summaries(
+            {"_id": {"$in": [ObjectId(party_id) for party_id, _ in ranked[:limit]]}}
+        )
+    }
+    return {
+        "parties": [
+            parties[party_id].model_dump()
+            for party_id, _ in ranked[:limit]
+            if party_id in parties
+        ],
+        "next_cursor": (
+            encode_cursor(list(ranked[limit - 1])) if len(ranked) > limit else None
+        ),
+    }
@@ -0,0 +1,76 @@
+import os
+import time
+
+from dotenv import find_dotenv, load_dotenv
+
+load_dotenv(find_dotenv())
+
+SYNC_DRIFT_THRESHOLD_MS = int(os.environ.get("SYNC_DRIFT_THRESHOLD_MS", 1000))
+
+
+class PlaybackSample:
+    """A currently playing response stamped with when it was taken on a monotonic clock."""
+
+    __slots__ = ("data", "sampled_at", "rtt_ms")
+
+    def __init__(self, data: dict, sampled_at: float, rtt_ms: float):
+        self.data = data
+        self.sampled_at = sampled_at
+        self.rtt_ms = rtt_ms
+
+    @property
+    def is_playing(self) -> bool:
+        return self.data["is_playing"]
+
+    @property
+    def uri(self) -> str | None:
+        return self.data.get("uri")
+
+    def position_at(self, now: float) -> float:
+        """Extrapolate the playback position in ms to the monotonic time now."""
+        if not self.is_playing:
+            return self.data["progress_ms"]
+        return self.data["progress_ms"] + (now - self.sampled_at) * 1000
+
+
+def sample_playback(data: dict, sent_at: float, received_at: float) -> PlaybackSample:
+    """Stamp a currently playing response with the timing of its HTTP exchange.
+
+    The sample is stamped with the midpoint of the exchange, which removes half of
+    the round trip from the age of the reported progress_ms. Time spent queued
+    before the request was sent must not be included, or the drift is skewed.
+    """
+    return PlaybackSample(
+        data, (sent_at + received_at) / 2, (received_at - sent_at) * 1000
+    )
+
+
+def playback_drift(owner: PlaybackSample, member: PlaybackSample) -> float | None:
+    """Get how far in ms the member is ahead of the owner right now.
+
+    Returns None if the member is playing a different song.
+    """
+    if owner.uri != member.uri:
+        return None
+    now = time.monotonic()
+    return member.position_at(now) - owner.position_at(now)
+
+
+def needs_seek(
+    owner: PlaybackSample,
+    member: PlaybackSample,
+    threshold_ms: int = SYNC_DRIFT_THRESHOLD_MS,
+) -> bool:
+    """Check whether the corrected drift between member and owner is past the threshold."""
+    drift = playback_drift(owner, member)
+    return drift is None or abs(drift) > threshold_ms
+
+
+def seek_position(owner: PlaybackSample, member: PlaybackSample) -> int:
+    """Get the position to seek the member to so it lands on the owner's position.
+
+    Half of the member's measured round trip is added to cover the time the play
+    request takes to reach Spotify.
+    """
+    position = round(owner.position_at(time.monotonic()) + member.rtt_ms / 2)
+    return min(position, owner.data.get("duration_ms", position))
@@ -0,0 +1,175 @@
+import numpy as np
+
+from ..utils.party_registry import PartyRecord, currently_listening
+
+GENRE_PROFILE_WIDTH = 5
+
+
+def rank_weights(genres: list[str]) -> dict[str, float]:
+    """Weights a ranked genre list, favouring the genres listed first."""
+    return {genre: 1 / (rank + 1) for rank, genre in enumerate(genres)}
+
+
+class GenreIndex:
+    """Genre profiles of public parties, scored against a user in one pass.
+
+    Genres are interned into a vocabulary and every party is a fixed-width row
+    of genre ids and unit-normalised rank weights. Posting lists map every genre
+    id to the rows tagged with it, so only parties sharing a genre with the user
+    are scored. Rows are kept current from party registry changes and reused
+    after a party is removed.
+    """
+
+    def __init__(self, capacity: int = 1024):
+        self._vocabulary: dict[str, int] = {"": 0}
+        self._ids = np.zeros((capacity, GENRE_PROFILE_WIDTH), dtype=np.int32)
+        self._weights = np.zeros((capacity, GENRE_PROFILE_WIDTH), dtype=np.float32)
+        self._party_ids: list[str | None] = []
+        self._rows: dict[str, int] = {}
+        self._free: list[int] = []
+        self._postings: dict[int, set[int]] = {}
+        self._members: dict[str, frozenset] = {}
+        self._user_parties: dict[str, set[str]] = {}
+
+    def __len__(self) -> int:
+        return len(self._rows)
+
+    def _intern(self, genre: str) -> int:
+        return self._vocabulary.setdefault(genre, len(self._vocabulary))
+
+    def _allocate(self) -> int:
+        if self._free:
+            return self._free.pop()
+        row = len(self._party_ids)
+        if row == len(self._ids):
+            self._ids = np.concatenate([self._ids, np.zeros_like(self._ids)])
+            self._weights = np.concatenate(
+                [self._weights, np.zeros_like(self._weights)]
+            )
+        self._party_ids.append(None)
+        return row
+
+    def apply(
+        self, party_id: str, previous: PartyRecord | None, record: PartyRecord | None
+    ) -> None:
+        """Index a changed party, or drop it if it was removed or is not public."""
+        if record is None or record.type != "public" or not record.genres:
+            self.remove(party_id)
+            return
+
+        row = self._rows.get(party_id)
+        if row is None:
+            row = self._allocate()
+            self._rows[party_id] = row
+            self._party_ids[row] = party_id
+
+        weights = rank_weights(record.genres[:GENRE_PROFILE_WIDTH])
+        norm = np.sqrt(sum(i * i for i in weights.values()))
+        self._unpost(row)
+        self._ids[row] = 0
+        self._weights[row] = 0
+        for column, (genre, weight) in enumerate(weights.items()):
+            self._ids[row, column] = self._intern(genre)
+            self._weights[row, column] = weight / norm
+        for genre_id in self._ids[row]:
+            if genre_id:
+                self._postings.setdefault(int(genre_id), set()).add(row)
+        self._set_members(party_id, frozenset(record.users))
+
+    def remove(self, party_id: str) -> None:
+        """Drop a party and free its row."""
+        row = self._rows.pop(party_id, None)
+        if row is None:
+            return
+        self._unpost(row)
+        self._ids[row] = 0
+        self._weights[row] = 0
+        self._party_ids[row] = None
+        self._free.append(row)
+        self._set_members(party_id, frozenset())
+
+    def _unpost(self, row: int) -> None:
+        """Drop a row from the posting lists of its current genres."""
+        for genre_id in self._ids[row]:
+            rows = self._postings.get(int(genre_id))
+            if rows is not None:
+                rows.discard(row)
+                if not rows:
+                    del self._postings[int(genre_id)]
+
+    def _set_members(self, party_id: str, members: frozenset) -> None:
+        previous = self._members.pop(party_id, frozenset())
+        for user_id in previous - members:
+            parties = self._user_parties[user_id]
+            parties.discard(party_id)
+            if not parties:
+                del self._user_parties[user_id]
+        for user_id in members - previous:
+            self._user_parties.setdefault(user_id, set()).add(party_id)
+        if members:
+            self._members[party_id] = members
+
+    def match(
+        self,
+        genre_weights: dict[str, float],
+        exclude_user: str = None,
+        limit: int = 0,
+        after: tuple[str, float] = None,
+    ) -> list[tuple[str, float]]:
+        """Rank public parties by the cosine similarity of their genres to a user's.
+
+        Returns (party_id, score) pairs ordered by score, then party id, leaving
+        out parties without a shared genre and parties exclude_user is already a
+        member of. Passing the last pair of a page as after returns the next page.
+        A limit of 0 returns every match.
+        """
+        norm = np.sqrt(sum(i * i for i in genre_weights.values()))
+        if not self._rows or not norm:
+            return []
+        profile = np.zeros(len(self._vocabulary), dtype=np.float32)
+        for genre, weight in genre_weights.items():
+            if genre in self._vocabulary:
+                profile[self._vocabulary[genre]] = weight / norm
+        profile[0] = 0
+
+        rows = set()
+        for genre in genre_weights:
+            rows.update(self._postings.get(self._vocabulary.get(genre, 0), ()))
+        rows.difference_update(
+            self._rows[party_id]
+            for party_id in self._user_parties.get(exclude_user, ())
+            if party_id in self._rows
+        )
+        if not rows:
+            return []
+
+        candidates = np.fromiter(rows, dtype=np.intp, count=len(rows))
+        scores = (profile[self._ids[candidates]] * self._weights[candidates]).sum(
+            axis=1
+        )
+        keep = scores > 0
+        if after:
+            party_id, score = after
+            keep &= scores <= score
+            for i in np.flatnonzero(keep & (scores == score)):
+                keep[i] = self._party_ids[candidates[i]] > party_id
+        candidates, scores = candidates[keep], scores[keep]
+        if limit and limit < len(candidates):
+            cutoff = np.partition(scores, len(candidates) - limit)[
+                len(candidates) - limit
+            ]
+            keep = scores >= cutoff
+            candidates, scores = candidates[keep], scores[keep]
+
+        ranked = sorted(
+            (
+                (self._party_ids[row], float(score))
+                for row, score in zip(candidates, scores)
+            ),
+            key=lambda item: (-item[1], item[0]),
+        )
+        return ranked[:limit] if limit else ranked
+
+
+genre_index = GenreIndex()
+currently_listening.add_listener(genre_index.apply)
@@ -0,0 +1,107 @@
+import logging
+
+from pymongo import errors
+
+from .logger_handler import LoggerFormatter
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.DEBUG)
+stream_handler = logging.StreamHandler()
+stream_handler.setFormatter(LoggerFormatter())
+logger.addHandler(stream_handler)
+
+
+class IndexDeclaration:
+    """An index a query function relies on, with a filter shaped like its query."""
+
+    __slots__ = ("query", "database", "collection", "keys", "unique", "sample_filter")
+
+    def __init__(
+        self,
+        query: str,
+        database: str,
+        collection: str,
+        keys: list[tuple[str, int]],
+        unique: bool,
+        sample_filter: dict,
+    ):
+        self.query = query
+        self.database = database
+        self.collection = collection
+        self.keys = keys
+        self.unique = unique
+        self.sample_filter = sample_filter
+
+
+declared_indexes: list[IndexDeclaration] = []
+collection_scan_queries: dict[str, str] = {}
+
+
+def uses_index(
+    database: str,
+    collection: str,
+    keys: list[tuple[str, int]],
+    sample_filter: dict,
+    unique: bool = False,
+):
+    """Declares the index a query function needs, so it is built at startup."""
+
+    def decorator(func):
+        declared_indexes.append(
+            IndexDeclaration(
+                func.__qualname__, database, collection, keys, unique, sample_filter
+            )
+        )
+        return func
+
+    return decorator
+
+
+def _uses_collection_scan(plan: dict) -> bool:
+    """Checks whether a query plan contains a collection scan stage."""
+    if plan.get("stage") == "COLLSCAN":
+        return True
+    children = plan.get("inputStages", []) + [
+        plan[i] for i in ("inputStage", "queryPlan") if i in plan
+    ]
+    return any(_uses_collection_scan(child) for child in children)
+
+
+async def build_indexes(client) -> dict[str, str]:
+    """Builds every declared index that is missing and verifies the query plans.
+
+    Existing indexes and data are never dropped. Returns the queries that still
+    fall back to a collection scan, mapped to the reason.
+    """
+    collection_scan_queries.clear()
+    for declaration in declared_indexes:
+        collection = client[declaration.database][declaration.collection]
+        existing = [i["key"] for i in (await collection.index_information()).values()]
+        if declaration.keys not in existing:
+            try:
+                await collection.create_index(
+                    declaration.keys, unique=declaration.unique
+                )
+                logger.info(
+                    f"Created index {declaration.keys} on "
+                    f"{declaration.database}.{declaration.collection}"
+                )
+            except errors.PyMongoError as e:
+                collection_scan_queries[declaration.query] = f"index build failed: {e}"
+                logger.error(
+                    f"Failed to create index {declaration.keys} for "
+                    f"{declaration.query}: {e}"
+                )
+                continue
+
+        try:
+            explain = await collection.find(declaration.sample_filter).explain()
+        except errors.PyMongoError as e:
+            logger.error(f"Failed to explain {declaration.query}: {e}")
+            continue
+        if _uses_collection_scan(explain["queryPlanner"]["winningPlan"]):
+            collection_scan_queries[declaration.query] = "collection scan"
+
+    for query, reason in collection_scan_queries.items():
+        logger.warning(f"{query} falls back to a collection scan ({reason})")
+    return collection_scan_queries
@@ -0,0 +1,141 @@
+import asyncio
+import bisect
+import hashlib
+import logging
+import os
+import socket
+import uuid
+
+from dotenv import find_dotenv, load_dotenv
+
+from ..utils.database_handler import (
+    acquire_party_lease,
+    get_live_sync_workers,
+    heartbeat_sync_worker,
+    release_party_lease,
+    remove_sync_worker,
+    renew_party_leases,
+)
+from ..utils.logger_handler import LoggerFormatter
+from ..utils.spotify_client import spotify_client
+
+load_dotenv(find_dotenv())
+
+LEASE_HEARTBEAT_INTERVAL = float(os.environ.get("LEASE_HEARTBEAT_INTERVAL", 5))
+LEASE_TTL = float(os.environ.get("LEASE_TTL", 15))
+HASH_RING_REPLICAS = 64
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.DEBUG)
+stream_handler = logging.StreamHandler()
+stream_handler.setFormatter(LoggerFormatter())
+logger.addHandler(stream_handler)
+
+
+def _hash(key: str) -> int:
+    return int.from_bytes(hashlib.md5(key.encode()).digest()[:8], "big")
+
+
+class HashRing:
+    """Consistent hash ring mapping party ids to sync workers."""
+
+    def __init__(self, nodes: list[str], replicas: int = HASH_RING_REPLICAS):
+        self.nodes = sorted(nodes)
+        self._ring = sorted(
+            (_hash(f"{node}#{i}"), node) for node in self.nodes for i in range(replicas)
+        )
+        self._keys = [key for key, _ in self._ring]
+
+    def node_for(self, key: str) -> str | None:
+        """Get the worker responsible for a key."""
+        if not self._ring:
+            return None
+        index = bisect.bisect(self._keys, _hash(key)) % len(self._ring)
+        return self._ring[index][1]
+
+
+class LeaseManager:
+    """Partitions parties across sync workers using Mongo lease documents.
+
+    Every worker heartbeats into parties.sync_workers, places the live workers on a
+    consistent hash ring and holds a lease in parties.sync_leases for each party the
+    ring assigns to it. When a worker stops heartbeating its parties move to the
+    remaining workers once their leases expire. The Spotify rate limit is split
+    evenly between the live workers.
+    """
+
+    def __init__(self):
+        self.worker_id = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self.ring = HashRing([self.worker_id])
+        self.owned: set[str] = set()
+        self._task: asyncio.Task | None = None
+
+    def owns(self, party_id) -> bool:
+        """Check whether this worker currently holds the lease of a party."""
+        return str(party_id) in self.owned
+
+    def assigned(self, key) -> bool:
+        """Check whether the ring assigns a key, such as a user id, to this worker."""
+        return self.ring.node_for(str(key)) == self.worker_id
+
+    async def rebalance(self, party_ids: list) -> None:
+        """Heartbeat, rebuild the ring and acquire or release leases to match it.
+
+        Leases already held are renewed together, only newly assigned parties are
+        acquired one by one.
+        """
+        await heartbeat_sync_worker(self.worker_id)
+        workers = await get_live_sync_workers(LEASE_TTL)
+        if self.worker_id not in workers:
+            workers.append(self.worker_id)
+        if sorted(workers) != self.ring.nodes:
+            self.ring = HashRing(workers)
+            logger.info(f"Party sync ring rebuilt with {len(workers)} worker(s)")
+            spotify_client.rate_limiter.share(len(workers))
+
+        party_ids = {str(i) for i in party_ids}
+        assigned = {i for i in party_ids if self.ring.node_for(i) == self.worker_id}
+        released = self.owned - assigned
+        await asyncio.gather(
+            *[release_party_lease(i, self.worker_id) for i in released]
+        )
+
+        held = sorted(assigned & self.owned)
+        renewed = (
+            await renew_party_leases(held, self.worker_id, LEASE_TTL) if held else set()
+        )
+        new = sorted(assigned - self.owned)
+        acquired = await asyncio.gather(
+            *[acquire_party_lease(i, self.worker_id, LEASE_TTL) for i in new]
+        )
+        self.owned = renewed | {i for i, ok in zip(new, acquired) if ok}
+
+    async def run(self, get_party_ids) -> None:
+        """Rebalance leases every LEASE_HEARTBEAT_INTERVAL seconds until cancelled."""
+        while True:
+            try:
+                await self.rebalance(get_party_ids())
+            except Exception as e:
+                logger.error(f"Lease rebalance failed: {e!r}")
+            await asyncio.sleep(LEASE_HEARTBEAT_INTERVAL)
+
+    async def start(self, get_party_ids) -> None:
+        """Start heartbeating and rebalancing in the background."""
+        if not self._task:
+            await self.rebalance(get_party_ids())
+            self._task = asyncio.create_task(self.run(get_party_ids))
+
+    async def stop(self) -> None:
+        """Stop rebalancing and hand every held lease back."""
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await remove_sync_worker(self.worker_id)
+        self.owned.clear()
+
+
+lease_manager = LeaseManager()
@@ -0,0 +1,24 @@
+import base64
+import json
+
+
+class InvalidCursor(ValueError):
+    """Raised for a continuation token that was not issued by encode_cursor."""
+
+
+def encode_cursor(position: list) -> str:
+    """Encodes the sort position of the last item of a page as an opaque token."""
+    return base64.urlsafe_b64encode(
+        json.dumps(position, separators=(",", ":")).encode()
+    ).decode()
+
+
+def decode_cursor(cursor: str) -> list:
+    """Decodes a continuation token, raising InvalidCursor if it is malformed."""
+    try:
+        position = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+    except (ValueError, TypeError) as e:
+        raise InvalidCursor(f"Invalid cursor {cursor}") from e
+    if not isinstance(position, list):
+        raise InvalidCursor(f"Invalid cursor {cursor}")
+    return position
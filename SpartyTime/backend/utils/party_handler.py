@@ -1,28 +1,45 @@
+import asyncio
 import logging
+import os
 import time
-import traceback
 
-from fastapi_utils.tasks import repeat_every
+import pydantic
+from dotenv import find_dotenv, load_dotenv
 
 from ..utils.database_handler import (
     PartyDataModel,
+    PartyModel,
+    convert_to_bson_id,
     delete_party_instance,
-    get_party_instance,
-    get_user_by_id,
-    remove_party_member,
-    update_party_instance,
     get_parties,
+    get_party_instance,
+    queue_party_changes,
+    queue_remove_party_member,
+)
+from ..utils.drift_model import (
+    PlaybackSample,
+    needs_seek,
+    seek_position,
 )
 from ..utils.logger_handler import LoggerFormatter
+from ..utils.party_registry import currently_listening
 from ..utils.spotify_handler import (
-    get_currently_playing,
+    SPOTIFY_IDS_PER_REQUEST,
+    get_playback_sample,
     get_queue,
     get_recently_played,
     get_several_artists,
     play_song,
 )
+from ..utils.sync_engine import sync_engine
+from ..utils.token_manager import token_manager
+
+load_dotenv(find_dotenv())
 
-currently_listening = {}
+INACTIVITY_TIMEOUT = 150
+QUEUE_MAX_AGE = float(os.environ.get("QUEUE_MAX_AGE", 60))
+
+queue_fetched_at = {}
 
 logger = logging.getLogger(__name__)
 logger.setLevel(logging.DEBUG)
@@ -31,141 +48,289 @@ stream_handler.setFormatter(LoggerFormatter())
 logger.addHandler(stream_handler)
 
 
-@repeat_every(seconds=5, raise_exceptions=True)
-async def check_for_inactivity():
-    """Check for inactivity in parties and delete them if inactive for more than 150 seconds (2.5 mins)."""
-    for party_id in currently_listening.keys():
-        e = await get_party_instance(party_id)
-        if not e:
-            currently_listening.pop(party_id)
-        if not e.party_data:
-            continue
-        try:
-            party_data = e.party_data
-            if (
-                abs(party_data.time_since_last_played - time.time()) >= 150
-                and not party_data.is_playing
-            ):
-                await delete_party_instance(party_id)
-                currently_listening.pop(party_id)
-        except KeyError:
-            continue
-        except TypeError:
-            currently_listening.pop(party_id)
-            logger.info(f"Party {party_id} has been deleted due to inactivity.")
-
-
-@repeat_every(seconds=5, raise_exceptions=True)
-async def add_new_parties():
-    """Add new parties to the currently listening dictionary."""
-    parties = await get_parties()
-
-    for party in parties:
-        if party.id not in currently_listening.keys():
-            currently_listening[party.id] = party.party_info.users
-
-
-@repeat_every(seconds=5, raise_exceptions=True)
-async def update_party_details():
-    """Update the party details in the database."""
-    for party_id in currently_listening.keys():
-        try:
-            party = await get_party_instance(party_id)
-            owner = await get_user_by_id(party.party_info.owner)
-            if not party:
-                currently_listening.pop(party_id)
-            owner_token = owner.spotify_session_data.access_token
-            owner_currently_playing = await get_currently_playing(owner_token)
-            party_data = PartyDataModel(
-                is_playing=owner_currently_playing["is_playing"],
-                current_song={},
-                time_since_last_played=round(time.time()),
-                queue=[i.model_dump() for i in (await get_queue(owner_token))[:5]],
-                history=[
-                    i.model_dump() for i in await get_recently_played(owner_token)
-                ],
-            )
-            owner_current_song = owner_currently_playing
-            del owner_current_song["is_playing"]
-            party_data.current_song = owner_current_song
-            party.party_data = party_data
-            await update_party_instance(party_id, party.model_dump())
-        except Exception:
-            traceback.print_exc()
-
-            continue
-
-
-@repeat_every(seconds=5, raise_exceptions=True)
-async def update_playback():
-    """Update the playback of the parties in the currently listening dictionary."""
-    for party_id, users in currently_listening.items():
-        party = await get_party_instance(party_id)
-        if not party:
-            currently_listening.pop(party_id)
-        if not party.party_data:
-            continue
-        owner = await get_user_by_id(party.party_info.owner)
-        owner_token = owner.spotify_session_data.access_token
-        owner_currently_playing = await get_currently_playing(owner_token)
-
-        for user in users:
-            if party.party_info.owner == str(user):
-                continue
-            user = await get_user_by_id(user)
+class PartySnapshot(pydantic.BaseModel):
+    """State of a party loaded once per tick and shared by every tick stage."""
 
-            user_token = user.spotify_session_data.access_token
-            user_currently_playing = await get_currently_playing(user_token)
+    party: PartyModel
+    owner_token: str
+    owner_playback: PlaybackSample
 
-            if not user_currently_playing["is_playing"]:
-                await remove_party_member(party_id, str(user.id))
-                continue
+    model_config = {"arbitrary_types_allowed": True}
 
-            if not owner_currently_playing["is_playing"]:
-                continue
+    @property
+    def owner_currently_playing(self) -> dict:
+        return self.owner_playback.data
 
-            if user_currently_playing["uri"] != party.party_data.current_song[
-                "uri"
-            ] or not user_currently_playing["progress_ms"] in range(
-                party.party_data.current_song["progress_ms"] - 1000,
-                party.party_data.current_song["progress_ms"] + 1000,
-            ):
-                await play_song(
-                    user_token,
-                    party.party_data.current_song["uri"],
-                    party.party_data.current_song["progress_ms"],
-                )
-
-
-@repeat_every(seconds=300, raise_exceptions=True)
-async def update_party_genre():
-    """Update the party genres in the database."""
-    for party_id in currently_listening.keys():
-        party = await get_party_instance(party_id)
-        if not party:
-            currently_listening.pop(party_id)
-        if not party.party_data:
-            continue
-        party_data = party.party_data
-        owner = await get_user_by_id(party.party_info.owner)
-        owner_token = owner.spotify_session_data.access_token
-        history_artist_uris = [
-            i["uri"] for item in party_data.history for i in item["artists"]
-        ]
-        artists = (await get_several_artists(owner_token, history_artist_uris))[
-            "artists"
-        ]
-        genres = {}
-        for artist in artists:
+    @property
+    def party_id(self) -> str:
+        return str(self.party.id)
+
+
+def release_party(party_id) -> None:
+    """Drop the per-party state of a party this worker no longer syncs."""
+    queue_fetched_at.pop(str(party_id), None)
+    sync_engine.forget_party(str(party_id))
+
+
+def forget_party(party_id) -> None:
+    """Stop tracking a party that was deleted or no longer exists."""
+    currently_listening.pop(party_id)
+    release_party(party_id)
+
+
+async def load_snapshot(party_id) -> PartySnapshot | None:
+    """Load the party, its owner and the owner's playback once for this tick."""
+    try:
+        party = await sync_engine.run(
+            str(party_id), lambda: get_party_instance(str(party_id))
+        )
+    except ValueError:
+        forget_party(party_id)
+        return None
+    owner_token = await sync_engine.run(
+        str(party_id), lambda: token_manager.get_token(party.party_info.owner)
+    )
+    owner_playback = await sync_engine.run(
+        str(party_id),
+        lambda: get_playback_sample(owner_token),
+    )
+    return PartySnapshot(
+        party=party, owner_token=owner_token, owner_playback=owner_playback
+    )
+
+
+async def check_for_inactivity(snapshot: PartySnapshot) -> bool:
+    """Delete the party if it has been inactive for more than 150 seconds (2.5 mins).
+
+    Returns whether the party is still alive.
+    """
+    party_data = snapshot.party.party_data
+    if not party_data or snapshot.owner_currently_playing["is_playing"]:
+        return True
+    if abs(party_data.time_since_last_played - time.time()) < INACTIVITY_TIMEOUT:
+        return True
+
+    await delete_party_instance(snapshot.party_id)
+    forget_party(snapshot.party_id)
+    logger.info(f"Party {snapshot.party_id} has been deleted due to inactivity.")
+    return False
+
+
+def queue_stale(snapshot: PartySnapshot) -> bool:
+    """Check whether the stored queue and history need to be fetched again.
+
+    They only change when the track changes, so they are refetched on a new track
+    URI or once they are older than QUEUE_MAX_AGE seconds.
+    """
+    party_data = snapshot.party.party_data
+    fetched_at = queue_fetched_at.get(snapshot.party_id)
+    return (
+        not party_data
+        or not fetched_at
+        or party_data.current_song.get("uri") != snapshot.owner_playback.uri
+        or time.monotonic() - fetched_at >= QUEUE_MAX_AGE
+    )
+
+
+async def update_party_details(snapshot: PartySnapshot) -> None:
+    """Update the party details in the database from the owner's playback."""
+    party = snapshot.party
+    owner_token = snapshot.owner_token
+    owner_current_song = dict(snapshot.owner_currently_playing)
+    is_playing = owner_current_song.pop("is_playing")
+
+    if queue_stale(snapshot):
+        queue, history = await asyncio.gather(
+            sync_engine.run(snapshot.party_id, lambda: get_queue(owner_token)),
+            sync_engine.run(
+                snapshot.party_id, lambda: get_recently_played(owner_token)
+            ),
+        )
+        queue = queue[:5]
+        queue_fetched_at[snapshot.party_id] = time.monotonic()
+    else:
+        queue, history = party.party_data.queue, party.party_data.history
+
+    party.party_data = PartyDataModel(
+        is_playing=is_playing,
+        current_song=owner_current_song,
+        time_since_last_played=(
+            round(time.time())
+            if is_playing or not party.party_data
+            else party.party_data.time_since_last_played
+        ),
+        queue=queue,
+        history=history,
+    )
+    queue_party_changes(party)
+
+
+async def sync_member(snapshot: PartySnapshot, user_id: str) -> None:
+    """Bring a single party member in line with the owner's playback.
+
+    The member is only seeked when the drift between both latency compensated
+    positions is larger than SYNC_DRIFT_THRESHOLD_MS.
+    """
+    party_id = snapshot.party_id
+    owner_playback = snapshot.owner_playback
+    user_token = await sync_engine.run(
+        party_id, lambda: token_manager.get_token(user_id)
+    )
+    user_playback = await sync_engine.run(
+        party_id, lambda: get_playback_sample(user_token)
+    )
+
+    if not user_playback.is_playing:
+        queue_remove_party_member(party_id, user_id)
+        return
+
+    if not owner_playback.is_playing:
+        return
+
+    if needs_seek(owner_playback, user_playback):
+        await sync_engine.run(
+            party_id,
+            lambda: play_song(
+                user_token,
+                owner_playback.uri,
+                seek_position(owner_playback, user_playback),
+            ),
+        )
+
+
+async def update_playback(snapshot: PartySnapshot) -> None:
+    """Sync every member of the party to the owner's playback concurrently."""
+    party = snapshot.party
+    if not party.party_data:
+        return
+
+    members = [
+        str(user)
+        for user in party.party_info.users
+        if party.party_info.owner != str(user)
+    ]
+    await token_manager.prime(members)
+    results = await asyncio.gather(
+        *[sync_member(snapshot, user) for user in members],
+        return_exceptions=True,
+    )
+    for result in results:
+        if isinstance(result, Exception):
+            logger.error(
+                f"Failed to sync member of party {snapshot.party_id}: {result!r}"
+            )
+
+
+async def update_party_genre(party: PartyModel, artists: dict) -> None:
+    """Update the party genres in the database from the artists of its history."""
+    genres = {}
+    for item in party.party_data.history:
+        for history_artist in item["artists"]:
             try:
-                for genre in artist["genres"]:
+                for genre in artists[history_artist["uri"]]["genres"]:
                     if genre in genres:
                         genres[genre] += 1
                     else:
                         genres[genre] = 1
-            except KeyError:
+            except (KeyError, TypeError):
                 continue
-        party.party_info.genres = sorted(
-            list(genres.keys()), key=lambda x: genres[x], reverse=True
-        )[:5]
-        await update_party_instance(party_id, party.model_dump())
+    party.party_info.genres = sorted(
+        list(genres.keys()), key=lambda x: genres[x], reverse=True
+    )[:5]
+    queue_party_changes(party)
+
+
+async def get_party_artists(owners: list, uris: list) -> dict:
+    """Look up artists in chunks, spreading the requests over the party owners.
+
+    Each chunk is fetched with the token of the next owner and falls back to the
+    other owners when their token or the lookup fails. Chunks that fail for every
+    owner are logged and left out, as are artists Spotify did not return.
+    """
+
+    async def fetch(index: int, chunk: list) -> dict:
+        error = None
+        for offset in range(len(owners)):
+            owner = owners[(index + offset) % len(owners)]
+            try:
+                token = await token_manager.get_token(owner)
+                response = await get_several_artists(token, chunk)
+                return {
+                    uri: artist
+                    for uri, artist in zip(chunk, response["artists"])
+                    if artist
+                }
+            except Exception as e:
+                error = e
+        logger.error(f"Failed to look up {len(chunk)} party artists: {error!r}")
+        return {}
+
+    chunks = await asyncio.gather(
+        *[
+            fetch(index, uris[i : i + SPOTIFY_IDS_PER_REQUEST])
+            for index, i in enumerate(range(0, len(uris), SPOTIFY_IDS_PER_REQUEST))
+        ]
+    )
+    return {uri: artist for chunk in chunks for uri, artist in chunk.items()}
+
+
+async def update_party_genres(party_ids: list) -> None:
+    """Update the genres of several parties from one batched artist lookup.
+
+    The parties are loaded together and their artist ids collected across all of
+    them, so each artist is looked up once, in as few requests as possible.
+    Parties with artists that could not be looked up keep their genres.
+    """
+    parties = [
+        party
+        for party in await get_parties(
+            {"_id": {"$in": [convert_to_bson_id(str(i)) for i in party_ids]}}
+        )
+        if party.party_data
+    ]
+    if not parties:
+        return
+
+    artist_uris = list(
+        {
+            i["uri"]
+            for party in parties
+            for item in party.party_data.history
+            for i in item["artists"]
+        }
+    )
+    artists = {}
+    if artist_uris:
+        owners = list(dict.fromkeys(str(party.party_info.owner) for party in parties))
+        artists = await get_party_artists(owners, artist_uris)
+    parties = [
+        party
+        for party in parties
+        if all(
+            i["uri"] in artists
+            for item in party.party_data.history
+            for i in item["artists"]
+        )
+    ]
+
+    results = await asyncio.gather(
+        *[update_party_genre(party, artists) for party in parties],
+        return_exceptions=True,
+    )
+    for party, result in zip(parties, results):
+        if isinstance(result, Exception):
+            logger.error(f"Failed to update genres of party {party.id}: {result!r}")
+
+
+async def run_party_tick(party_id) -> PartySnapshot | None:
+    """Run the per-party tick stages against one shared snapshot.
+
+    Returns the snapshot, or None if the party no longer exists. Genres are
+    updated separately for every leased party at once, see update_party_genres.
+    """
+    snapshot = await load_snapshot(party_id)
+    if not snapshot or not await check_for_inactivity(snapshot):
+        return None
+    await update_party_details(snapshot)
+    await update_playback(snapshot)
+    return snapshot
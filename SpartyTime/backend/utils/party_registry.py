@@ -0,0 +1,202 @@
+import asyncio
+import logging
+import os
+from typing import Callable
+
+from dotenv import find_dotenv, load_dotenv
+from pymongo import errors
+
+from ..utils.database_handler import get_party_registry_documents, watch_party_changes
+from ..utils.logger_handler import LoggerFormatter
+
+load_dotenv(find_dotenv())
+
+PARTY_REGISTRY_POLL_INTERVAL = float(os.environ.get("PARTY_REGISTRY_POLL_INTERVAL", 5))
+PARTY_REGISTRY_MAX_BACKOFF = float(os.environ.get("PARTY_REGISTRY_MAX_BACKOFF", 60))
+# Returned by servers that are not part of a replica set.
+CHANGE_STREAMS_UNSUPPORTED = 40573
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.DEBUG)
+stream_handler = logging.StreamHandler()
+stream_handler.setFormatter(LoggerFormatter())
+logger.addHandler(stream_handler)
+
+
+class PartyRecord:
+    """Compact in-memory record of a live party."""
+
+    __slots__ = ("party_id", "owner", "users", "type", "genres")
+
+    def __init__(
+        self, party_id: str, owner: str, users: tuple, type: str, genres: tuple
+    ):
+        self.party_id = party_id
+        self.owner = owner
+        self.users = users
+        self.type = type
+        self.genres = genres
+
+    @classmethod
+    def from_document(cls, document: dict) -> "PartyRecord":
+        """Builds a record from a (projected) party document."""
+        party_info = document.get("party_info", {})
+        return cls(
+            str(document["_id"]),
+            str(party_info.get("owner", "")),
+            tuple(str(i) for i in party_info.get("users", [])),
+            party_info.get("type", ""),
+            tuple(party_info.get("genres", [])),
+        )
+
+    def __eq__(self, other) -> bool:
+        return isinstance(other, PartyRecord) and all(
+            getattr(self, i) == getattr(other, i) for i in self.__slots__
+        )
+
+
+class PartyRegistry:
+    """Registry of live parties kept current from the parties collection.
+
+    Mutations replace single entries, and keys(), values() and items() return
+    copies, so callers can iterate while the registry is being updated.
+    """
+
+    def __init__(self):
+        self._records: dict[str, PartyRecord] = {}
+        self._listeners: list[Callable] = []
+        self._task: asyncio.Task | None = None
+
+    def __contains__(self, party_id) -> bool:
+        return str(party_id) in self._records
+
+    def __len__(self) -> int:
+        return len(self._records)
+
+    def get(self, party_id) -> PartyRecord | None:
+        return self._records.get(str(party_id))
+
+    def keys(self) -> list[str]:
+        return list(self._records.keys())
+
+    def values(self) -> list[PartyRecord]:
+        return list(self._records.values())
+
+    def items(self) -> list[tuple[str, PartyRecord]]:
+        return list(self._records.items())
+
+    def add_listener(
+        self, listener: Callable[[str, PartyRecord | None, PartyRecord | None], None]
+    ) -> None:
+        """Calls listener with the party id, old and new record whenever a party changes.
+
+        The old record is None when the party was added, the new record is None
+        when it was removed.
+        """
+        self._listeners.append(listener)
+        for party_id, record in self.items():
+            listener(party_id, None, record)
+
+    def _set(self, record: PartyRecord) -> None:
+        previous = self._records.get(record.party_id)
+        if previous != record:
+            self._records[record.party_id] = record
+            for listener in self._listeners:
+                listener(record.party_id, previous, record)
+
+    def upsert(self, document: dict) -> PartyRecord:
+        """Adds a party or updates its record from a party document."""
+        record = PartyRecord.from_document(document)
+        self._set(record)
+        return record
+
+    def pop(self, party_id, default=None) -> PartyRecord | None:
+        """Removes a party from the registry."""
+        record = self._records.pop(str(party_id), None)
+        if record is None:
+            return default
+        for listener in self._listeners:
+            listener(record.party_id, record, None)
+        return record
+
+    def replace_all(self, documents: list[dict]) -> None:
+        """Applies a full listing of parties, adding, updating and removing records."""
+        records = [PartyRecord.from_document(i) for i in documents]
+        seen = {record.party_id for record in records}
+        for party_id in self._records.keys() - seen:
+            self.pop(party_id)
+        for record in records:
+            self._set(record)
+
+    def apply_change(self, change: dict) -> None:
+        """Applies a single change stream event."""
+        operation = change["operationType"]
+        party_id = change["documentKey"]["_id"]
+        if operation == "delete":
+            self.pop(party_id)
+        elif change.get("fullDocument"):
+            self.upsert({"_id": party_id, **change["fullDocument"]})
+        elif operation in ("update", "replace"):
+            self.pop(party_id)
+
+    async def _poll(self) -> None:
+        """Keeps the registry current by polling, for servers without change streams."""
+        while True:
+            await asyncio.sleep(PARTY_REGISTRY_POLL_INTERVAL)
+            try:
+                self.replace_all(await get_party_registry_documents())
+            except Exception as e:
+                logger.error(f"Party registry poll failed: {e!r}")
+
+    async def run(self) -> None:
+        """Follows the parties collection until cancelled.
+
+        The change stream is reopened with an exponential backoff whenever it
+        fails. Only servers without change stream support fall back to polling.
+        """
+        backoff = PARTY_REGISTRY_POLL_INTERVAL
+        while True:
+            try:
+                async with watch_party_changes() as stream:
+                    self.replace_all(await get_party_registry_documents())
+                    backoff = PARTY_REGISTRY_POLL_INTERVAL
+                    async for change in stream:
+                        try:
+                            self.apply_change(change)
+                        except Exception as e:
+                            logger.error(
+                                f"Failed to apply party change {change!r}: {e!r}"
+                            )
+            except errors.OperationFailure as e:
+                if e.code != CHANGE_STREAMS_UNSUPPORTED:
+                    logger.error(f"Party change stream failed: {e!r}")
+                    await asyncio.sleep(backoff)
+                    backoff = min(backoff * 2, PARTY_REGISTRY_MAX_BACKOFF)
+                    continue
+                logger.warning(
+                    f"Change streams unavailable ({e.code}), polling parties instead"
+                )
+                await self._poll()
+            except Exception as e:
+                logger.error(f"Party change stream failed: {e!r}")
+                await asyncio.sleep(backoff)
+                backoff = min(backoff * 2, PARTY_REGISTRY_MAX_BACKOFF)
+
+    async def start(self) -> None:
+        """Loads every party and starts following changes in the background."""
+        if not self._task:
+            self.replace_all(await get_party_registry_documents())
+            self._task = asyncio.create_task(self.run())
+
+    async def stop(self) -> None:
+        """Stops following changes."""
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+
+currently_listening = PartyRegistry()
@@ -0,0 +1,261 @@
+import asyncio
+import heapq
+import itertools
+import logging
+import os
+import time
+
+from dotenv import find_dotenv, load_dotenv
+
+from ..utils.database_handler import user_cache_stats
+from ..utils.discovery_cache import discovery_cache_stats
+from ..utils.lease_manager import lease_manager
+from ..utils.logger_handler import LoggerFormatter
+from ..utils.party_handler import (
+    PartySnapshot,
+    release_party,
+    run_party_tick,
+    update_party_genres,
+)
+from ..utils.party_registry import currently_listening
+from ..utils.spotify_client import spotify_client
+from ..utils.spotify_handler import (
+    catalog_cache_stats,
+    coalescing_stats,
+    update_user_genre,
+)
+from ..utils.sync_engine import sync_engine
+from ..utils.token_manager import token_manager
+from ..utils.write_buffer import write_buffer
+
+load_dotenv(find_dotenv())
+
+PARTY_SYNC_INTERVAL = float(os.environ.get("PARTY_SYNC_INTERVAL", 5))
+PARTY_IDLE_MAX_INTERVAL = float(os.environ.get("PARTY_IDLE_MAX_INTERVAL", 30))
+PARTY_MIN_INTERVAL = 0.5
+TRACK_BOUNDARY_MARGIN = 0.25
+REGISTRY_POLL_INTERVAL = 1.0
+GENRE_UPDATE_INTERVAL = float(os.environ.get("GENRE_UPDATE_INTERVAL", 300))
+STATS_LOG_INTERVAL = float(os.environ.get("STATS_LOG_INTERVAL", 60))
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.DEBUG)
+stream_handler = logging.StreamHandler()
+stream_handler.setFormatter(LoggerFormatter())
+logger.addHandler(stream_handler)
+
+
+def worker_stats() -> dict:
+    """Get the Spotify request, rate limiter, sync and cache statistics of this worker."""
+    return {
+        "spotify": spotify_client.stats(),
+        "sync": sync_engine.stats(),
+        "catalog_cache": catalog_cache_stats(),
+        "coalescing": coalescing_stats(),
+        "user_cache": user_cache_stats(),
+        "discovery_cache": discovery_cache_stats(),
+    }
+
+
+class PartyScheduler:
+    """Schedules party ticks on a priority queue of per-party deadlines.
+
+    Playing parties are checked every PARTY_SYNC_INTERVAL seconds and right after
+    their current track ends, idle or paused parties back off exponentially up to
+    PARTY_IDLE_MAX_INTERVAL seconds. Only parties leased to this worker are ticked.
+    Every due party is ticked in its own task and reschedules itself as soon as
+    its tick is done, so a slow party never holds back the deadlines of others.
+    """
+
+    def __init__(self):
+        self._deadlines: list[tuple[float, int, object]] = []
+        self._scheduled: dict = {}
+        self._idle_intervals: dict = {}
+        self._counter = itertools.count()
+        self._ticking: set = set()
+        self._pending_writes: dict = {}
+        self._tasks: set[asyncio.Task] = set()
+        self._task: asyncio.Task | None = None
+        self._genre_task: asyncio.Task | None = None
+        self._stats_task: asyncio.Task | None = None
+
+    def schedule(self, party_id, delay: float = 0) -> None:
+        """Schedule the next tick of a party, replacing any earlier deadline."""
+        deadline = time.monotonic() + delay
+        self._scheduled[party_id] = deadline
+        heapq.heappush(self._deadlines, (deadline, next(self._counter), party_id))
+
+    def unschedule(self, party_id) -> None:
+        """Stop scheduling a party. Its queued deadline is discarded lazily."""
+        self._scheduled.pop(party_id, None)
+        self._drop(party_id)
+
+    def _drop(self, party_id) -> None:
+        """Forget the state kept for a party that is no longer ticked here."""
+        self._idle_intervals.pop(party_id, None)
+        self._pending_writes.pop(party_id, None)
+        release_party(party_id)
+
+    def next_delay(self, party_id, snapshot: PartySnapshot) -> float:
+        """Compute how long to wait before checking a party again."""
+        playing = snapshot.owner_currently_playing
+        if not playing["is_playing"]:
+            interval = min(
+                self._idle_intervals.get(party_id, PARTY_SYNC_INTERVAL / 2) * 2,
+                PARTY_IDLE_MAX_INTERVAL,
+            )
+            self._idle_intervals[party_id] = interval
+            return interval
+
+        self._idle_intervals.pop(party_id, None)
+        remaining = (playing["duration_ms"] - playing["progress_ms"]) / 1000
+        return max(
+            min(PARTY_SYNC_INTERVAL, remaining + TRACK_BOUNDARY_MARGIN),
+            PARTY_MIN_INTERVAL,
+        )
+
+    def _pop_due(self) -> list:
+        """Pop every party whose deadline has passed."""
+        now = time.monotonic()
+        due = []
+        while self._deadlines and self._deadlines[0][0] <= now:
+            deadline, _, party_id = heapq.heappop(self._deadlines)
+            if self._scheduled.get(party_id) != deadline:
+                continue
+            del self._scheduled[party_id]
+            if party_id in currently_listening and lease_manager.owns(party_id):
+                due.append(party_id)
+            else:
+                self._drop(party_id)
+        return due
+
+    async def _tick_party(self, party_id, primed: asyncio.Task) -> None:
+        """Tick a single party and queue its next check.
+
+        The writes of the previous tick are awaited first, so the party is never
+        loaded before its last changes were sent. The pending writes future is
+        shared by every party, so it is shielded from the cancellation of a tick.
+        """
+        try:
+            await asyncio.wait([primed])
+            pending = self._pending_writes.pop(party_id, None)
+            if pending is not None:
+                await asyncio.shield(pending)
+            start = time.monotonic()
+            try:
+                snapshot = await run_party_tick(party_id)
+            except Exception as e:
+                logger.error(f"Tick of party {party_id} failed: {e!r}")
+                self.schedule(party_id, PARTY_SYNC_INTERVAL)
+                return
+            finally:
+                sync_engine.record_tick(str(party_id), time.monotonic() - start)
+            self._pending_writes[party_id] = write_buffer.pending()
+            if snapshot is None:
+                self.unschedule(party_id)
+                return
+            self.schedule(party_id, self.next_delay(party_id, snapshot))
+        finally:
+            self._ticking.discard(party_id)
+
+    def _track(self, coro) -> asyncio.Task:
+        """Run a coroutine as a task that is cancelled when the scheduler stops."""
+        task = asyncio.create_task(coro)
+        self._tasks.add(task)
+        task.add_done_callback(self._task_done)
+        return task
+
+    def _task_done(self, task: asyncio.Task) -> None:
+        self._tasks.discard(task)
+        if not task.cancelled() and task.exception() is not None:
+            logger.error(f"Party scheduler task failed: {task.exception()!r}")
+
+    def run_once(self) -> None:
+        """Pick up newly leased parties and start a tick task for every due party."""
+        for party_id in currently_listening.keys():
+            if (
+                party_id not in self._scheduled
+                and party_id not in self._ticking
+                and lease_manager.owns(party_id)
+            ):
+                self.schedule(party_id)
+
+        due = self._pop_due()
+        if due:
+            self._ticking.update(due)
+            primed = self._track(
+                token_manager.prime(
+                    [currently_listening.get(party_id).owner for party_id in due]
+                )
+            )
+            for party_id in due:
+                self._track(self._tick_party(party_id, primed))
+
+    async def run(self) -> None:
+        """Run the scheduler until cancelled."""
+        while True:
+            try:
+                self.run_once()
+            except Exception as e:
+                logger.error(f"Party scheduler iteration failed: {e!r}")
+
+            delay = REGISTRY_POLL_INTERVAL
+            if self._deadlines:
+                delay = min(delay, self._deadlines[0][0] - time.monotonic())
+            await asyncio.sleep(max(delay, 0))
+
+    async def run_genres(self) -> None:
+        """Update the genres of every leased party together until cancelled.
+
+        Parties are updated from their stored history every GENRE_UPDATE_INTERVAL
+        seconds, so all of them share one batched artist lookup. The genres of the
+        users assigned to this worker are refreshed once first, in the background
+        so startup does not wait on the rate limiter.
+        """
+        try:
+            await update_user_genre(all=True)
+        except Exception as e:
+            logger.error(f"User genre update failed: {e!r}")
+
+        while True:
+            await asyncio.sleep(GENRE_UPDATE_INTERVAL)
+            party_ids = [i for i in currently_listening.keys() if lease_manager.owns(i)]
+            if not party_ids:
+                continue
+            try:
+                await update_party_genres(party_ids)
+            except Exception as e:
+                logger.error(f"Party genre update failed: {e!r}")
+
+    async def run_stats(self) -> None:
+        """Log the statistics of this worker every STATS_LOG_INTERVAL seconds."""
+        while True:
+            await asyncio.sleep(STATS_LOG_INTERVAL)
+            try:
+                logger.info(f"Worker stats: {worker_stats()}")
+            except Exception as e:
+                logger.error(f"Collecting worker stats failed: {e!r}")
+
+    async def start(self) -> None:
+        """Start the scheduler, the genre updates and the stats log in the background."""
+        if not self._task:
+            self._task = asyncio.create_task(self.run())
+            self._genre_task = asyncio.create_task(self.run_genres())
+            self._stats_task = asyncio.create_task(self.run_stats())
+
+    async def stop(self) -> None:
+        """Stop the background scheduler."""
+        for task in (self._task, self._genre_task, self._stats_task):
+            if task:
+                task.cancel()
+                try:
+                    await task
+                except asyncio.CancelledError:
+                    pass
+        self._task = self._genre_task = self._stats_task = None
+        for task in list(self._tasks):
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+
+
+party_scheduler = PartyScheduler()
@@ -0,0 +1,262 @@
+import asyncio
+import heapq
+import itertools
+import os
+import time
+from contextlib import asynccontextmanager
+from email.utils import parsedate_to_datetime
+
+import aiohttp
+from dotenv import find_dotenv, load_dotenv
+
+load_dotenv(find_dotenv())
+
+SPOTIFY_API_URL = "https://api.spotify.com/"
+SPOTIFY_POOL_SIZE = int(os.environ.get("SPOTIFY_POOL_SIZE", 100))
+SPOTIFY_POOL_SIZE_PER_HOST = int(os.environ.get("SPOTIFY_POOL_SIZE_PER_HOST", 50))
+SPOTIFY_KEEPALIVE_TIMEOUT = float(os.environ.get("SPOTIFY_KEEPALIVE_TIMEOUT", 60))
+SPOTIFY_DNS_CACHE_TTL = int(os.environ.get("SPOTIFY_DNS_CACHE_TTL", 300))
+SPOTIFY_REQUEST_TIMEOUT = float(os.environ.get("SPOTIFY_REQUEST_TIMEOUT", 10))
+SPOTIFY_CONNECT_TIMEOUT = float(os.environ.get("SPOTIFY_CONNECT_TIMEOUT", 3))
+SPOTIFY_PLAYBACK_TIMEOUT = float(os.environ.get("SPOTIFY_PLAYBACK_TIMEOUT", 5))
+SPOTIFY_RATE_LIMIT = float(os.environ.get("SPOTIFY_RATE_LIMIT", 10))
+SPOTIFY_RATE_BURST = float(os.environ.get("SPOTIFY_RATE_BURST", 20))
+SPOTIFY_MAX_RETRIES = int(os.environ.get("SPOTIFY_MAX_RETRIES", 3))
+
+PRIORITY_PLAYBACK = 0
+PRIORITY_INTERACTIVE = 1
+PRIORITY_SYNC = 2
+PRIORITY_BACKGROUND = 3
+PRIORITY_NAMES = {
+    PRIORITY_PLAYBACK: "playback",
+    PRIORITY_INTERACTIVE: "interactive",
+    PRIORITY_SYNC: "sync",
+    PRIORITY_BACKGROUND: "background",
+}
+
+
+class SpotifyError(Exception):
+    def __init__(self, message: str):
+        super().__init__(message)
+
+
+def parse_retry_after(value: str | None, default: float = 1) -> float:
+    """Parse a Retry-After header given in seconds or as an HTTP date."""
+    if not value:
+        return default
+    try:
+        return max(float(value), 0)
+    except ValueError:
+        pass
+    try:
+        return max(parsedate_to_datetime(value).timestamp() - time.time(), 0)
+    except (TypeError, ValueError, IndexError, OverflowError):
+        return default
+
+
+class RequestTiming:
+    """Monotonic send and receive times of the request that produced a response.
+
+    Waiting for the rate limiter and for the Retry-After of an earlier 429 is not
+    included, only the HTTP exchange itself.
+    """
+
+    __slots__ = ("sent_at", "received_at")
+
+    def __init__(self):
+        self.sent_at = 0.0
+        self.received_at = 0.0
+
+
+class RateLimiter:
+    """Token bucket sized to the app quota that releases waiters by priority.
+
+    SPOTIFY_RATE_LIMIT and SPOTIFY_RATE_BURST are the quota of the whole app, and
+    each worker process takes an equal share of it, see share(). Lower priority
+    values are served first. A 429 pauses every priority until its Retry-After
+    has passed.
+    """
+
+    def __init__(
+        self, rate: float = SPOTIFY_RATE_LIMIT, burst: float = SPOTIFY_RATE_BURST
+    ):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.paused_until = 0.0
+        self.throttled = 0
+        self._updated_at = time.monotonic()
+        self._waiters: list[tuple[int, int, asyncio.Future]] = []
+        self._counter = itertools.count()
+        self._task: asyncio.Task | None = None
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self.tokens = min(
+            self.burst, self.tokens + (now - self._updated_at) * self.rate
+        )
+        self._updated_at = now
+
+    async def acquire(self, priority: int = PRIORITY_SYNC) -> None:
+        """Wait until a request of the given priority may be sent."""
+        self._refill()
+        if (
+            not self._waiters
+            and self.tokens >= 1
+            and time.monotonic() >= self.paused_until
+        ):
+            self.tokens -= 1
+            return
+
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._waiters, (priority, next(self._counter), future))
+        if not self._task or self._task.done():
+            self._task = asyncio.create_task(self._dispatch())
+        await future
+
+    def share(self, workers: int) -> None:
+        """Limit this process to its share of the quota among the live workers."""
+        workers = max(workers, 1)
+        self._refill()
+        self.rate = SPOTIFY_RATE_LIMIT / workers
+        self.burst = max(SPOTIFY_RATE_BURST / workers, 1)
+        self.tokens = min(self.tokens, self.burst)
+
+    def pause(self, seconds: float) -> None:
+        """Hold back every request for the given number of seconds."""
+        self.throttled += 1
+        self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+
+    async def _dispatch(self) -> None:
+        """Release queued waiters in priority order as tokens become available."""
+        while self._waiters:
+            now = time.monotonic()
+            if now < self.paused_until:
+                await asyncio.sleep(self.paused_until - now)
+                continue
+            self._refill()
+            if self.tokens < 1:
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+                continue
+
+            _, _, future = heapq.heappop(self._waiters)
+            if not future.done():
+                self.tokens -= 1
+                future.set_result(None)
+
+    def queue_depth(self) -> dict:
+        """Get the number of queued requests per priority."""
+        depth = {name: 0 for name in PRIORITY_NAMES.values()}
+        for priority, _, future in self._waiters:
+            if not future.done():
+                depth[PRIORITY_NAMES.get(priority, str(priority))] += 1
+        return depth
+
+
+class SpotifyClient:
+    """Shared pooled HTTP client for every request made to Spotify."""
+
+    def __init__(self):
+        self.session: aiohttp.ClientSession | None = None
+        self.rate_limiter = RateLimiter()
+        self.requests = 0
+        self.errors = 0
+        self.in_flight = 0
+        self.peak_in_flight = 0
+
+    async def open(self) -> None:
+        """Open the pooled session with keep-alive and DNS caching."""
+        connector = aiohttp.TCPConnector(
+            limit=SPOTIFY_POOL_SIZE,
+            limit_per_host=SPOTIFY_POOL_SIZE_PER_HOST,
+            keepalive_timeout=SPOTIFY_KEEPALIVE_TIMEOUT,
+            ttl_dns_cache=SPOTIFY_DNS_CACHE_TTL,
+            use_dns_cache=True,
+        )
+        self.session = aiohttp.ClientSession(
+            connector=connector,
+            timeout=aiohttp.ClientTimeout(
+                total=SPOTIFY_REQUEST_TIMEOUT, connect=SPOTIFY_CONNECT_TIMEOUT
+            ),
+        )
+
+    async def close(self) -> None:
+        """Close the pooled session and all of its connections."""
+        if self.session:
+            await self.session.close()
+            self.session = None
+
+    @asynccontextmanager
+    async def request(
+        self,
+        method: str,
+        url: str,
+        timeout: float = None,
+        priority: int = PRIORITY_SYNC,
+        timing: RequestTiming = None,
+        **kwargs,
+    ):
+        """Make a request through the pool, optionally with its own total timeout.
+
+        Web API requests wait for the rate limiter at the given priority and are
+        retried after the Retry-After delay when Spotify answers with a 429. The
+        exchange that produced the response is recorded in timing, if given.
+        """
+        if not self.session:
+            await self.open()
+        if timeout is not None:
+            kwargs["timeout"] = aiohttp.ClientTimeout(
+                total=timeout, connect=SPOTIFY_CONNECT_TIMEOUT
+            )
+        rate_limited = url.startswith(SPOTIFY_API_URL)
+
+        for attempt in range(SPOTIFY_MAX_RETRIES + 1):
+            if rate_limited:
+                await self.rate_limiter.acquire(priority)
+
+            self.requests += 1
+            self.in_flight += 1
+            self.peak_in_flight = max(self.peak_in_flight, self.in_flight)
+            sent_at = time.monotonic()
+            try:
+                resp = await self.session.request(method, url, **kwargs)
+            except (aiohttp.ClientError, asyncio.TimeoutError):
+                self.errors += 1
+                self.in_flight -= 1
+                raise
+            received_at = time.monotonic()
+
+            if resp.status == 429 and attempt < SPOTIFY_MAX_RETRIES:
+                try:
+                    retry_after = parse_retry_after(resp.headers.get("Retry-After"))
+                finally:
+                    resp.release()
+                    self.in_flight -= 1
+                self.rate_limiter.pause(retry_after)
+                continue
+
+            if timing is not None:
+                timing.sent_at = sent_at
+                timing.received_at = received_at
+            try:
+                yield resp
+            finally:
+                resp.release()
+                self.in_flight -= 1
+            return
+
+    def stats(self) -> dict:
+        """Get request, pool usage and rate limiter statistics."""
+        return {
+            "requests": self.requests,
+            "errors": self.errors,
+            "in_flight": self.in_flight,
+            "peak_in_flight": self.peak_in_flight,
+            "pool_size": SPOTIFY_POOL_SIZE,
+            "pool_size_per_host": SPOTIFY_POOL_SIZE_PER_HOST,
+            "throttled": self.rate_limiter.throttled,
+            "queue_depth": self.rate_limiter.queue_depth(),
+        }
+
+
+spotify_client = SpotifyClient()
@@ -1,42 +1,59 @@
-import base64
+import asyncio
 import os
 import traceback
 
-import aiohttp
-import pydantic
-import six
+import orjson
 from dotenv import find_dotenv, load_dotenv
-from pydantic import BaseModel
 
+from .cache import SingleFlight, TTLCache
+from .discovery_cache import invalidate_user_matches
 from .database_handler import (
-    SpotifySessionModel,
-    get_user_by_access_token,
     get_user_by_id,
     get_users,
-    update_session,
     update_user,
 )
+from .drift_model import PlaybackSample, sample_playback
+from .lease_manager import lease_manager
+from .spotify_client import (
+    PRIORITY_BACKGROUND,
+    PRIORITY_INTERACTIVE,
+    PRIORITY_PLAYBACK,
+    PRIORITY_SYNC,
+    SPOTIFY_PLAYBACK_TIMEOUT,
+    RequestTiming,
+    SpotifyError,
+    spotify_client,
+)
+from .token_manager import token_manager
 
 load_dotenv(find_dotenv())
 
-SPOTIFY_CLIENT_ID = os.environ["SPOTIFY_CLIENT_ID"]
-SPOTIFY_CLIENT_SECRET = os.environ["SPOTIFY_CLIENT_SECRET"]
+json_loads = orjson.loads
 
+SPOTIFY_IDS_PER_REQUEST = 50
+USER_GENRE_PROFILE_SIZE = 20
+CATALOG_CACHE_SIZE = int(os.environ.get("CATALOG_CACHE_SIZE", 10000))
+CATALOG_CACHE_TTL = float(os.environ.get("CATALOG_CACHE_TTL", 86400))
 
-async def create_session():
-    """Create an aiohttp session."""
-    global session
-    session = aiohttp.ClientSession()
+SPOTIFY_COALESCE_TTL = float(os.environ.get("SPOTIFY_COALESCE_TTL", 1))
 
+# currently playing results are never reused after the call finished, the drift
+# model relies on them being fresh.
+currently_playing_flight = SingleFlight()
+queue_flight = SingleFlight(SPOTIFY_COALESCE_TTL)
+details_flight = SingleFlight(SPOTIFY_COALESCE_TTL)
+artist_cache = TTLCache(CATALOG_CACHE_SIZE, CATALOG_CACHE_TTL)
+track_cache = TTLCache(CATALOG_CACHE_SIZE, CATALOG_CACHE_TTL)
 
-async def close_session():
-    """Close the aiohttp session."""
-    await session.close()
+
+async def create_session():
+    """Open the shared Spotify client."""
+    await spotify_client.open()
 
 
-class SpotifyError(Exception):
-    def __init__(self, message: str):
-        super().__init__(message)
+async def close_session():
+    """Close the shared Spotify client."""
+    await spotify_client.close()
 
 
 def get_headers(access_token: str) -> dict:
@@ -47,318 +64,390 @@ def get_headers(access_token: str) -> dict:
     }
 
 
-class Artist(BaseModel):
-    name: str
-    uri: str
+def spotify_id(uri: str) -> str:
+    """Get the id part of a Spotify URI."""
+    return uri.rpartition(":")[2]
 
 
-class Album(BaseModel):
-    name: str
-    uri: str
-    image: str
-
+def parse_track(track: dict) -> dict:
+    """Parse a track object into the stored song shape, with ids instead of URIs."""
+    album = track["album"]
+    return {
+        "name": track["name"],
+        "uri": spotify_id(track["uri"]),
+        "album": {
+            "name": album["name"],
+            "uri": spotify_id(album["uri"]),
+            "image": album["images"][0]["url"],
+        },
+        "artists": [
+            {"name": artist["name"], "uri": spotify_id(artist["uri"])}
+            for artist in track["artists"]
+        ],
+    }
 
-class ParsedItem(BaseModel):
-    name: str
-    uri: str
-    album: Album
-    artists: list[Artist]
 
+async def read_json(resp) -> dict | None:
+    """Decode a response body with orjson straight from its bytes.
 
-class CurrentlyPlaying(pydantic.BaseModel):
-    is_playing: bool
-    progress_ms: int
-    name: str
-    uri: str
-    album: Album
-    artists: list
+    aiohttp's resp.json() decodes the body to str before calling loads, which
+    skips orjson's bytes path. An empty body is answered with None like it does.
+    """
+    body = await resp.read()
+    return json_loads(body) if body.strip() else None
 
 
-def parse_items_json(items: dict, type: str = "recent") -> list[ParsedItem]:
+def parse_items_json(items: dict, type: str = "recent") -> list[dict]:
     """Parse the items from the Spotify API response."""
-    parse_with = "items"
     if type == "queue":
-        parse_with = "queue"
-
-    return [
-        ParsedItem(
-            name=item["name"] if type != "recent" else item["track"]["name"],
-            uri=(item["uri"] if type != "recent" else item["track"]["uri"]).split(":")[
-                2
-            ],
-            album=Album(
-                name=(
-                    item["album"]["name"]
-                    if type != "recent"
-                    else item["track"]["album"]["name"]
-                ),
-                uri=(
-                    item["album"]["uri"]
-                    if type != "recent"
-                    else item["track"]["album"]["uri"]
-                ).split(":")[2],
-                image=(
-                    item["album"]["images"][0]["url"]
-                    if type != "recent"
-                    else item["track"]["album"]["images"][0]["url"]
-                ),
-            ),
-            artists=[
-                Artist(
-                    name=artist["name"],
-                    uri=artist["uri"].split(":")[2],
-                )
-                for artist in (
-                    item["artists"] if type != "recent" else item["track"]["artists"]
-                )
-            ],
-        )
-        for item in items[parse_with]
-    ]
+        return [parse_track(item) for item in items["queue"]]
+    return [parse_track(item["track"]) for item in items["items"]]
 
 
-async def get_spotify_details(access_token: str) -> dict:
-    """Get the Spotify details for the user."""
-    session = aiohttp.ClientSession()
+def parse_currently_playing(resp_json: dict) -> dict:
+    """Parse a currently playing response, keeping the full URIs."""
+    item = resp_json["item"]
+    album = item["album"]
+    return {
+        "is_playing": resp_json["is_playing"],
+        "progress_ms": resp_json["progress_ms"],
+        "duration_ms": item["duration_ms"],
+        "name": item["name"],
+        "uri": item["uri"],
+        "album": {
+            "name": album["name"],
+            "uri": album["uri"],
+            "image": album["images"][0]["url"],
+        },
+        "artists": [
+            {"name": artist["name"], "uri": artist["uri"]} for artist in item["artists"]
+        ],
+    }
+
 
-    async with session.get(
+async def fetch_spotify_details(access_token: str) -> dict:
+    """Fetch the Spotify details for the user, bypassing coalescing."""
+    async with spotify_client.request(
+        "GET",
         f"https://api.spotify.com/v1/me",
         headers=get_headers(access_token),
+        priority=PRIORITY_INTERACTIVE,
     ) as resp:
         if resp.status == 401:
             try:
-                user = await get_user_by_access_token(access_token)
-                userid = str(user.id)
-                spotify_auth_data = await refresh_token(userid)
-                access_token = spotify_auth_data["access_token"]
-                return await get_spotify_details(access_token)
+                access_token = await token_manager.refresh_for_token(access_token)
+                return await fetch_spotify_details(access_token)
             except Exception:
                 raise SpotifyError(traceback.format_exc())
-        return await resp.json()
+        return await read_json(resp)
 
 
 async def refresh_token(userid: str) -> dict:
     """Refresh the Spotify token for given user id."""
-    userdata = await get_user_by_id(userid)
-    refresh_token = userdata.spotify_session_data.refresh_token
-
-    auth_header = base64.b64encode(
-        six.text_type(SPOTIFY_CLIENT_ID + ":" + SPOTIFY_CLIENT_SECRET).encode("ascii")
-    )
-
-    async with session.post(
-        "https://accounts.spotify.com/api/token",
-        headers={
-            "Authorization": f"Basic {auth_header.decode('ascii')}",
-            "Content-Type": "application/x-www-form-urlencoded",
-        },
-        data={
-            "refresh_token": refresh_token,
-            "grant_type": "refresh_token",
-        },
-    ) as resp:
-        dat = await resp.json()
+    return (await token_manager.refresh(userid)).model_dump()
 
-    session_data: dict = SpotifySessionModel(
-        **dat, refresh_token=refresh_token
-    ).model_dump()
 
-    e = await update_session(userid, session_data)
-    if e:
-        return session_data
-
-    raise SpotifyError("Failed to update session data")
-
-
-async def get_currently_playing(access_token: str) -> dict:
-    """Get the currently playing song for the user."""
-    async with session.get(
+async def fetch_currently_playing(
+    access_token: str, timing: RequestTiming = None
+) -> dict:
+    """Fetch the currently playing song for the user, bypassing coalescing."""
+    async with spotify_client.request(
+        "GET",
         f"https://api.spotify.com/v1/me/player/currently-playing",
+        timeout=SPOTIFY_PLAYBACK_TIMEOUT,
         headers=get_headers(access_token),
+        priority=PRIORITY_PLAYBACK,
+        timing=timing,
     ) as resp:
         if resp.status == 401:
             try:
-                user = await get_user_by_access_token(access_token)
-                userid = str(user.id)
-                spotify_auth_data = await refresh_token(userid)
-                access_token = spotify_auth_data["access_token"]
-                return await get_currently_playing(access_token)
+                access_token = await token_manager.refresh_for_token(access_token)
+                return await fetch_currently_playing(access_token, timing)
             except Exception:
                 raise SpotifyError(traceback.format_exc())
         if resp.status == 204:
             return {"is_playing": False}
-        resp_json = await resp.json()
-        return CurrentlyPlaying(
-            is_playing=resp_json["is_playing"],
-            progress_ms=resp_json["progress_ms"],
-            name=resp_json["item"]["name"],
-            uri=resp_json["item"]["uri"],
-            album=Album(
-                name=resp_json["item"]["album"]["name"],
-                uri=resp_json["item"]["album"]["uri"],
-                image=resp_json["item"]["album"]["images"][0]["url"],
-            ),
-            artists=[
-                Artist(name=artist["name"], uri=artist["uri"])
-                for artist in resp_json["item"]["artists"]
-            ],
-        ).model_dump()
-
-
-async def get_recently_played(
-    access_token: str, unix_timestamp: int = 0
-) -> list[ParsedItem]:
+        return parse_currently_playing(await read_json(resp))
+
+
+async def get_recently_played(access_token: str, unix_timestamp: int = 0) -> list[dict]:
     """Get the recently played songs for the user."""
-    async with session.get(
+    async with spotify_client.request(
+        "GET",
         (
             f"https://api.spotify.com/v1/me/player/recently-played?limit=5&after={unix_timestamp}"
             if unix_timestamp
             else f"https://api.spotify.com/v1/me/player/recently-played?limit=5"
         ),
         headers=get_headers(access_token),
+        priority=PRIORITY_SYNC,
     ) as resp:
-        await resp.json()
         if resp.status == 401:
             try:
-                user = await get_user_by_access_token(access_token)
-                userid = str(user.id)
-                spotify_auth_data = await refresh_token(userid)
-                access_token = spotify_auth_data["access_token"]
-                return await get_recently_played(access_token)
+                access_token = await token_manager.refresh_for_token(access_token)
+                return await get_recently_played(access_token, unix_timestamp)
             except Exception:
                 raise SpotifyError(traceback.format_exc())
-        return parse_items_json(await resp.json())
+        return parse_items_json(await read_json(resp))
 
 
-async def get_queue(access_token: str) -> list[ParsedItem]:
-    """Get the queue for the user."""
-    async with session.get(
+async def fetch_queue(access_token: str) -> list[dict]:
+    """Fetch the queue for the user, bypassing coalescing."""
+    async with spotify_client.request(
+        "GET",
         f"https://api.spotify.com/v1/me/player/queue?limit=5",
         headers=get_headers(access_token),
+        priority=PRIORITY_SYNC,
     ) as resp:
         if resp.status == 401:
             try:
-                user = await get_user_by_access_token(access_token)
-                userid = str(user.id)
-                spotify_auth_data = await refresh_token(userid)
-                access_token = spotify_auth_data["access_token"]
-                return await get_queue(access_token)
+                access_token = await token_manager.refresh_for_token(access_token)
+                return await fetch_queue(access_token)
             except Exception:
                 raise SpotifyError(traceback.format_exc())
-        return parse_items_json(await resp.json(), "queue")
+        return parse_items_json(await read_json(resp), "queue")
 
 
 async def play_song(access_token: str, uri: str, position_ms: int = 0) -> int:
     """Play a song for the user."""
     headers = get_headers(access_token)
     headers["Content-Type"] = "application/json"
-    async with session.put(
+    async with spotify_client.request(
+        "PUT",
         f"https://api.spotify.com/v1/me/player/play",
+        timeout=SPOTIFY_PLAYBACK_TIMEOUT,
         headers=headers,
         json={"uris": [uri], "position_ms": position_ms},
+        priority=PRIORITY_PLAYBACK,
     ) as resp:
         if resp.status == 401:
             try:
-                user = await get_user_by_access_token(access_token)
-                userid = str(user.id)
-                spotify_auth_data = await refresh_token(userid)
-                access_token = spotify_auth_data["access_token"]
-                return await play_song(access_token, uri)
+                access_token = await token_manager.refresh_for_token(access_token)
+                return await play_song(access_token, uri, position_ms)
             except Exception:
                 raise SpotifyError(traceback.format_exc())
         return resp.status
 
 
-async def get_several_tracks(access_token: str, uris: list) -> dict:
-    """Get several tracks by their uris."""
+async def fetch_several_tracks(access_token: str, uris: list) -> dict:
+    """Fetch several tracks by their uris from Spotify, bypassing the cache."""
     headers = get_headers(access_token)
-    async with session.get(
-        f"https://api.spotify.com/v1/tracks?ids={','.join(uris)}", headers=headers
+    async with spotify_client.request(
+        "GET",
+        f"https://api.spotify.com/v1/tracks?ids={','.join(uris)}",
+        headers=headers,
+        priority=PRIORITY_BACKGROUND,
     ) as resp:
         if resp.status == 401:
             try:
-                user = await get_user_by_access_token(access_token)
-                userid = str(user.id)
-                spotify_auth_data = await refresh_token(userid)
-                access_token = spotify_auth_data["access_token"]
-                return await get_several_tracks(access_token, uris)
+                access_token = await token_manager.refresh_for_token(access_token)
+                return await fetch_several_tracks(access_token, uris)
             except Exception:
                 raise SpotifyError(traceback.format_exc())
-        return await resp.json()
+        return await read_json(resp)
 
 
 async def get_top_artist_genres(access_token: str) -> list:
     """Get the top artist genres for the user."""
+    return list(await get_top_artist_genre_counts(access_token))
+
+
+async def get_top_artist_genre_counts(access_token: str) -> dict[str, int]:
+    """Get how many of the user's top artists play each genre, most common first."""
     headers = get_headers(access_token)
-    async with session.get(
-        f"https://api.spotify.com/v1/me/top/artists", headers=headers
+    async with spotify_client.request(
+        "GET",
+        f"https://api.spotify.com/v1/me/top/artists",
+        headers=headers,
+        priority=PRIORITY_BACKGROUND,
     ) as resp:
         if resp.status == 401:
             try:
-                user = await get_user_by_access_token(access_token)
-                userid = str(user.id)
-                spotify_auth_data = await refresh_token(userid)
-                access_token = spotify_auth_data["access_token"]
-                return await get_top_artist_genres(access_token)
+                access_token = await token_manager.refresh_for_token(access_token)
+                return await get_top_artist_genre_counts(access_token)
             except Exception:
                 raise SpotifyError(traceback.format_exc())
 
         genres = {}
-        for artist in (await resp.json())["items"]:
+        for artist in (await read_json(resp))["items"]:
             for genre in artist["genres"]:
                 if genre in genres:
                     genres[genre] += 1
                 else:
                     genres[genre] = 1
 
-        return sorted(list(genres.keys()), key=lambda x: genres[x], reverse=True)
+        return dict(sorted(genres.items(), key=lambda x: x[1], reverse=True))
 
 
 async def update_user_genre(user: str = "", all: bool = True) -> None:
-    """Update the user genres in the database."""
+    """Update the user genres in the database.
+
+    With all, only the users the sync ring assigns to this worker are updated.
+    """
     if all:
-        users = await get_users()
+        users = [i for i in await get_users() if lease_manager.assigned(i.id)]
     else:
         users = [await get_user_by_id(user)]
 
     for user_ in users:
-        user_token = user_.spotify_session_data.access_token
-        resp = await get_top_artist_genres(user_token)
-        user_.genres = resp[:5]
-        await update_user(str(user_.id), user_.model_dump())
+        user_token = await token_manager.get_token(
+            str(user_.id), user_.spotify_session_data
+        )
+        resp = await get_top_artist_genre_counts(user_token)
+        await update_user(
+            str(user_.id),
+            {
+                "genres": list(resp)[:5],
+                "genre_weights": dict(list(resp.items())[:USER_GENRE_PROFILE_SIZE]),
+            },
+        )
+        invalidate_user_matches(str(user_.id))
 
 
-async def get_song(access_token: str, uri: str):
-    """Get a song by its uri."""
+async def fetch_song(access_token: str, uri: str):
+    """Fetch a song by its uri from Spotify, bypassing the cache."""
     headers = get_headers(access_token)
-    async with session.get(
-        f"https://api.spotify.com/v1/tracks/{uri}", headers=headers
+    async with spotify_client.request(
+        "GET",
+        f"https://api.spotify.com/v1/tracks/{uri}",
+        headers=headers,
+        priority=PRIORITY_BACKGROUND,
     ) as resp:
         if resp.status == 401:
             try:
-                user = await get_user_by_access_token(access_token)
-                userid = str(user.id)
-                spotify_auth_data = await refresh_token(userid)
-                access_token = spotify_auth_data["access_token"]
-                return await get_song(access_token, uri)
+                access_token = await token_manager.refresh_for_token(access_token)
+                return await fetch_song(access_token, uri)
             except Exception:
                 raise SpotifyError(traceback.format_exc())
-        return await resp.json()
+        return await read_json(resp)
 
 
-async def get_several_artists(access_token: str, uris: list):
-    """Get several artists by their uris."""
+async def fetch_several_artists(access_token: str, uris: list):
+    """Fetch several artists by their uris from Spotify, bypassing the cache."""
     headers = get_headers(access_token)
-    async with session.get(
-        f"https://api.spotify.com/v1/artists?ids={','.join(uris)}", headers=headers
+    async with spotify_client.request(
+        "GET",
+        f"https://api.spotify.com/v1/artists?ids={','.join(uris)}",
+        headers=headers,
+        priority=PRIORITY_BACKGROUND,
     ) as resp:
         if resp.status == 401:
             try:
-                user = await get_user_by_access_token(access_token)
-                userid = str(user.id)
-                spotify_auth_data = await refresh_token(userid)
-                access_token = spotify_auth_data["access_token"]
-                return await get_several_artists(access_token, uris)
+                access_token = await token_manager.refresh_for_token(access_token)
+                return await fetch_several_artists(access_token, uris)
             except Exception:
                 raise SpotifyError(traceback.format_exc())
-        return await resp.json()
+        return await read_json(resp)
+
+
+async def get_cached(cache: TTLCache, uris: list, fetch) -> list:
+    """Get catalog objects by id from a cache, fetching only the missing ids.
+
+    Missing ids are deduplicated and fetched concurrently in chunks of at most
+    SPOTIFY_IDS_PER_REQUEST ids.
+    """
+    found = {uri: cache.get(uri) for uri in dict.fromkeys(uris)}
+    missing = [uri for uri, item in found.items() if item is None]
+    chunks = await asyncio.gather(
+        *[
+            fetch(missing[i : i + SPOTIFY_IDS_PER_REQUEST])
+            for i in range(0, len(missing), SPOTIFY_IDS_PER_REQUEST)
+        ]
+    )
+    for chunk in chunks:
+        for item in chunk:
+            if item:
+                cache.set(item["id"], item)
+                found[item["id"]] = item
+    return [found.get(uri) for uri in uris]
+
+
+async def get_several_tracks(access_token: str, uris: list) -> dict:
+    """Get several tracks by their uris."""
+
+    async def fetch(missing: list) -> list:
+        return (await fetch_several_tracks(access_token, missing)).get("tracks", [])
+
+    return {"tracks": await get_cached(track_cache, uris, fetch)}
+
+
+async def get_song(access_token: str, uri: str):
+    """Get a song by its uri."""
+    song = track_cache.get(uri)
+    if song is None:
+        song = await fetch_song(access_token, uri)
+        if "id" in song:
+            track_cache.set(song["id"], song)
+    return song
+
+
+async def get_several_artists(access_token: str, uris: list):
+    """Get several artists by their uris."""
+
+    async def fetch(missing: list) -> list:
+        return (await fetch_several_artists(access_token, missing)).get("artists", [])
+
+    return {"artists": await get_cached(artist_cache, uris, fetch)}
+
+
+async def get_spotify_details(access_token: str) -> dict:
+    """Get the Spotify details for the user.
+
+    Identical concurrent calls for the same user share one request.
+    """
+    return await details_flight.run(
+        ("me", access_token), lambda: fetch_spotify_details(access_token)
+    )
+
+
+async def fetch_playback_sample(access_token: str) -> PlaybackSample:
+    """Fetch the currently playing song for the user, timed by its HTTP exchange."""
+    timing = RequestTiming()
+    data = await fetch_currently_playing(access_token, timing)
+    return sample_playback(data, timing.sent_at, timing.received_at)
+
+
+async def get_playback_sample(access_token: str) -> PlaybackSample:
+    """Get the currently playing song for the user as a timed playback sample.
+
+    Identical concurrent calls for the same user share one request.
+    """
+    return await currently_playing_flight.run(
+        ("currently-playing", access_token),
+        lambda: fetch_playback_sample(access_token),
+    )
+
+
+async def get_currently_playing(access_token: str) -> dict:
+    """Get the currently playing song for the user.
+
+    Identical concurrent calls for the same user share one request.
+    """
+    return (await get_playback_sample(access_token)).data
+
+
+async def get_queue(access_token: str) -> list[dict]:
+    """Get the queue for the user.
+
+    Identical concurrent calls for the same user share one request.
+    """
+    return await queue_flight.run(
+        ("queue", access_token), lambda: fetch_queue(access_token)
+    )
+
+
+def coalescing_stats() -> dict:
+    """Get how many Spotify reads were saved by coalescing, per endpoint."""
+    return {
+        "me": details_flight.stats(),
+        "currently-playing": currently_playing_flight.stats(),
+        "queue": queue_flight.stats(),
+    }
+
+
+def catalog_cache_stats() -> dict:
+    """Get the size and hit rate of the artist and track caches."""
+    return {
+        "artists": artist_cache.stats(),
+        "tracks": track_cache.stats(),
+    }
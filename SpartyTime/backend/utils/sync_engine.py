@@ -0,0 +1,87 @@
+import asyncio
+import logging
+import os
+from typing import Awaitable, Callable
+
+from dotenv import find_dotenv, load_dotenv
+
+from ..utils.logger_handler import LoggerFormatter
+
+load_dotenv(find_dotenv())
+
+SYNC_MAX_CONCURRENCY = int(os.environ.get("SYNC_MAX_CONCURRENCY", 64))
+SYNC_MAX_PARTY_CONCURRENCY = int(os.environ.get("SYNC_MAX_PARTY_CONCURRENCY", 8))
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.DEBUG)
+stream_handler = logging.StreamHandler()
+stream_handler.setFormatter(LoggerFormatter())
+logger.addHandler(stream_handler)
+
+
+class SyncEngine:
+    """Runs party sync work concurrently under a global and a per-party concurrency limit."""
+
+    def __init__(
+        self,
+        max_concurrency: int = SYNC_MAX_CONCURRENCY,
+        max_party_concurrency: int = SYNC_MAX_PARTY_CONCURRENCY,
+    ):
+        self.max_concurrency = max_concurrency
+        self.max_party_concurrency = max_party_concurrency
+        self._global_limit = asyncio.Semaphore(max_concurrency)
+        self._party_limits: dict[str, asyncio.Semaphore] = {}
+        self.in_flight = 0
+        self.peak_in_flight = 0
+        self.last_tick_duration = 0.0
+        self.last_tick_calls = 0
+        self._tick_calls: dict[str, int] = {}
+
+    def _party_limit(self, party_id: str) -> asyncio.Semaphore:
+        """Get or create the semaphore limiting calls for a single party."""
+        limit = self._party_limits.get(party_id)
+        if limit is None:
+            limit = asyncio.Semaphore(self.max_party_concurrency)
+            self._party_limits[party_id] = limit
+        return limit
+
+    def forget_party(self, party_id: str) -> None:
+        """Drop the per-party limit of a party that no longer exists."""
+        self._party_limits.pop(party_id, None)
+        self._tick_calls.pop(party_id, None)
+
+    async def run(self, party_id: str, func: Callable[[], Awaitable]):
+        """Run a single call for a party once both limits allow it."""
+        async with self._party_limit(party_id):
+            async with self._global_limit:
+                self.in_flight += 1
+                self._tick_calls[party_id] = self._tick_calls.get(party_id, 0) + 1
+                self.peak_in_flight = max(self.peak_in_flight, self.in_flight)
+                try:
+                    return await func()
+                finally:
+                    self.in_flight -= 1
+
+    def record_tick(self, party_id: str, duration: float) -> None:
+        """Record how long a party tick took and how many calls it made."""
+        self.last_tick_duration = duration
+        self.last_tick_calls = self._tick_calls.pop(party_id, 0)
+        logger.debug(
+            f"Party {party_id} tick took {duration:.3f}s "
+            f"({self.last_tick_calls} calls, {self.in_flight} in flight, "
+            f"peak {self.peak_in_flight})"
+        )
+
+    def stats(self) -> dict:
+        """Get the current engine statistics."""
+        return {
+            "in_flight": self.in_flight,
+            "peak_in_flight": self.peak_in_flight,
+            "last_tick_duration": self.last_tick_duration,
+            "last_tick_calls": self.last_tick_calls,
+            "max_concurrency": self.max_concurrency,
+            "max_party_concurrency": self.max_party_concurrency,
+        }
+
+
+sync_engine = SyncEngine()
@@ -0,0 +1,225 @@
+import asyncio
+import base64
+import logging
+import os
+import time
+from typing import Callable
+
+import six
+from dotenv import find_dotenv, load_dotenv
+
+from .database_handler import (
+    SpotifySessionModel,
+    get_user_by_access_token,
+    get_user_by_id,
+    get_users_by_ids,
+    update_session,
+)
+from .cache import TTLCache
+from .logger_handler import LoggerFormatter
+from .spotify_client import SpotifyError, spotify_client
+
+load_dotenv(find_dotenv())
+
+SPOTIFY_CLIENT_ID = os.environ["SPOTIFY_CLIENT_ID"]
+SPOTIFY_CLIENT_SECRET = os.environ["SPOTIFY_CLIENT_SECRET"]
+TOKEN_REFRESH_MARGIN = int(os.environ.get("TOKEN_REFRESH_MARGIN", 300))
+TOKEN_REFRESH_CHECK_INTERVAL = float(os.environ.get("TOKEN_REFRESH_CHECK_INTERVAL", 30))
+TOKEN_IDLE_TIMEOUT = float(os.environ.get("TOKEN_IDLE_TIMEOUT", 900))
+TOKEN_ROTATED_TTL = float(os.environ.get("TOKEN_ROTATED_TTL", 300))
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.DEBUG)
+stream_handler = logging.StreamHandler()
+stream_handler.setFormatter(LoggerFormatter())
+logger.addHandler(stream_handler)
+
+
+class TokenManager:
+    """Hands out valid Spotify access tokens by user id.
+
+    Sessions are loaded on demand and forgotten after TOKEN_IDLE_TIMEOUT seconds
+    without use. Tokens are refreshed TOKEN_REFRESH_MARGIN seconds before they
+    expire when requested, and ahead of time by the background loop for the
+    active users it is given. Concurrent refreshes for the same user share a
+    single request.
+    """
+
+    def __init__(self):
+        self._sessions: dict[str, SpotifySessionModel] = {}
+        self._owners: dict[str, str] = {}
+        self._used_at: dict[str, float] = {}
+        # replaced access token -> user id, for requests still using the old one
+        self._rotated = TTLCache(10000, TOKEN_ROTATED_TTL)
+        self._refreshing: dict[str, asyncio.Task] = {}
+        self._task: asyncio.Task | None = None
+        self.refreshes = 0
+
+    def remember(self, user_id: str, session: SpotifySessionModel) -> None:
+        """Track the session of a user."""
+        user_id = str(user_id)
+        previous = self._sessions.get(user_id)
+        if previous and previous.access_token != session.access_token:
+            self._owners.pop(previous.access_token, None)
+            self._rotated.set(previous.access_token, user_id)
+        self._sessions[user_id] = session
+        self._owners[session.access_token] = user_id
+
+    def forget(self, user_id: str) -> None:
+        """Stop tracking the session of a user."""
+        session = self._sessions.pop(str(user_id), None)
+        self._used_at.pop(str(user_id), None)
+        if session:
+            self._owners.pop(session.access_token, None)
+
+    def _expiring(self, session: SpotifySessionModel) -> bool:
+        """Check whether a session expires within the refresh margin.
+
+        Sessions stored before expires_at was recorded are assumed to be valid.
+        """
+        return bool(session.expires_at) and (
+            session.expires_at - time.time() < TOKEN_REFRESH_MARGIN
+        )
+
+    async def get_token(self, user_id: str, session: SpotifySessionModel = None) -> str:
+        """Get a valid access token for a user, refreshing it first if needed.
+
+        A session already loaded by the caller saves the lookup of an untracked
+        user.
+        """
+        user_id = str(user_id)
+        self._used_at[user_id] = time.monotonic()
+        session = self._sessions.get(user_id) or session
+        if not session:
+            session = (await get_user_by_id(user_id)).spotify_session_data
+        if user_id not in self._sessions:
+            self.remember(user_id, session)
+        if self._expiring(session):
+            session = await self.refresh(user_id)
+        return session.access_token
+
+    async def prime(self, user_ids: list) -> None:
+        """Load the sessions of every untracked user in one query."""
+        missing = [str(i) for i in user_ids if str(i) not in self._sessions]
+        if not missing:
+            return
+        now = time.monotonic()
+        self._used_at.update((str(i), now) for i in user_ids)
+        found = await get_users_by_ids(missing, ["spotify_session_data"])
+        for user_id, user in found.items():
+            self.remember(user_id, SpotifySessionModel(**user["spotify_session_data"]))
+
+    async def refresh(self, user_id: str) -> SpotifySessionModel:
+        """Refresh the token of a user, joining a refresh already in progress."""
+        user_id = str(user_id)
+        task = self._refreshing.get(user_id)
+        if not task:
+            task = asyncio.create_task(self._refresh(user_id))
+            self._refreshing[user_id] = task
+            task.add_done_callback(lambda _: self._refreshing.pop(user_id, None))
+        return await asyncio.shield(task)
+
+    async def refresh_for_token(self, access_token: str) -> str:
+        """Refresh the token of whoever owns a rejected access token.
+
+        A token that was already replaced is answered with the current token of
+        its user instead of a second refresh.
+        """
+        user_id = self._rotated.get(access_token)
+        if user_id:
+            return await self.get_token(user_id)
+        user_id = self._owners.get(access_token)
+        if not user_id:
+            user_id = str((await get_user_by_access_token(access_token)).id)
+        return (await self.refresh(user_id)).access_token
+
+    async def _refresh(self, user_id: str) -> SpotifySessionModel:
+        """Request a new access token from Spotify and store it."""
+        session = self._sessions.get(user_id)
+        if not session:
+            session = (await get_user_by_id(user_id)).spotify_session_data
+        refresh_token = session.refresh_token
+
+        auth_header = base64.b64encode(
+            six.text_type(SPOTIFY_CLIENT_ID + ":" + SPOTIFY_CLIENT_SECRET).encode(
+                "ascii"
+            )
+        )
+
+        async with spotify_client.request(
+            "POST",
+            "https://accounts.spotify.com/api/token",
+            headers={
+                "Authorization": f"Basic {auth_header.decode('ascii')}",
+                "Content-Type": "application/x-www-form-urlencoded",
+            },
+            data={
+                "refresh_token": refresh_token,
+                "grant_type": "refresh_token",
+            },
+        ) as resp:
+            dat = await resp.json()
+
+        try:
+            session = SpotifySessionModel(
+                **{
+                    **dat,
+                    "refresh_token": dat.get("refresh_token", refresh_token),
+                    "expires_at": round(time.time()) + dat["expires_in"],
+                }
+            )
+        except KeyError:
+            raise SpotifyError(f"Failed to refresh token for user {user_id}: {dat}")
+
+        if not await update_session(user_id, session.model_dump()):
+            raise SpotifyError("Failed to update session data")
+        self.remember(user_id, session)
+        self.refreshes += 1
+        return session
+
+    def evict_idle(self, active: set[str]) -> None:
+        """Forget sessions that were not used for TOKEN_IDLE_TIMEOUT seconds."""
+        cutoff = time.monotonic() - TOKEN_IDLE_TIMEOUT
+        for user_id in list(self._sessions):
+            if user_id not in active and self._used_at.get(user_id, 0) < cutoff:
+                self.forget(user_id)
+
+    async def run(self, get_active_users: Callable[[], set[str]]) -> None:
+        """Refresh the tokens of active users shortly before they expire.
+
+        Runs until cancelled, forgetting idle sessions on every pass.
+        """
+        while True:
+            await asyncio.sleep(TOKEN_REFRESH_CHECK_INTERVAL)
+            active = get_active_users()
+            self.evict_idle(active)
+            expiring = [
+                user_id
+                for user_id in active
+                if user_id in self._sessions and self._expiring(self._sessions[user_id])
+            ]
+            results = await asyncio.gather(
+                *[self.refresh(user_id) for user_id in expiring],
+                return_exceptions=True,
+            )
+            for user_id, result in zip(expiring, results):
+                if isinstance(result, Exception):
+                    logger.error(f"Failed to refresh token of {user_id}: {result!r}")
+
+    async def start(self, get_active_users: Callable[[], set[str]]) -> None:
+        """Start refreshing the tokens of active users in the background."""
+        if not self._task:
+            self._task = asyncio.create_task(self.run(get_active_users))
+
+    async def stop(self) -> None:
+        """Stop refreshing tokens in the background."""
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+
+token_manager = TokenManager()
@@ -0,0 +1,184 @@
+import asyncio
+import logging
+import os
+import time
+from typing import Callable
+
+from dotenv import find_dotenv, load_dotenv
+from pymongo import errors
+
+from .logger_handler import LoggerFormatter
+
+load_dotenv(find_dotenv())
+
+WRITE_BUFFER_MAX_OPS = int(os.environ.get("WRITE_BUFFER_MAX_OPS", 500))
+WRITE_BUFFER_FLUSH_INTERVAL = float(os.environ.get("WRITE_BUFFER_FLUSH_INTERVAL", 1))
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.DEBUG)
+stream_handler = logging.StreamHandler()
+stream_handler.setFormatter(LoggerFormatter())
+logger.addHandler(stream_handler)
+
+
+class WriteBuffer:
+    """Collects write operations and sends them as unordered bulk writes.
+
+    Operations are flushed when WRITE_BUFFER_MAX_OPS are buffered, every
+    WRITE_BUFFER_FLUSH_INTERVAL seconds, or when flush is called. Operations in
+    one flush may be applied in any order.
+    """
+
+    def __init__(self):
+        self._collections: dict[str, object] = {}
+        self._operations: dict[str, list] = {}
+        self._callbacks: list[Callable[[], None]] = []
+        self._flushed: asyncio.Future | None = None
+        self._sending: asyncio.Future | None = None
+        self._size = 0
+        self._lock = asyncio.Lock()
+        self._task: asyncio.Task | None = None
+        self._flush_tasks: set[asyncio.Task] = set()
+        self.flushes = 0
+        self.batches = 0
+        self.written = 0
+        self.failed = 0
+
+    def __len__(self) -> int:
+        return self._size
+
+    def add(self, collection, operation, on_flush: Callable[[], None] = None) -> None:
+        """Buffer a pymongo write operation for a collection.
+
+        on_flush is called once the operation has been sent.
+        """
+        self._collections[collection.full_name] = collection
+        self._operations.setdefault(collection.full_name, []).append(operation)
+        if on_flush:
+            self._callbacks.append(on_flush)
+        self._size += 1
+        if self._size >= WRITE_BUFFER_MAX_OPS:
+            task = asyncio.ensure_future(self.flush())
+            self._flush_tasks.add(task)
+            task.add_done_callback(self._flush_done)
+
+    def _flush_done(self, task: asyncio.Task) -> None:
+        self._flush_tasks.discard(task)
+        if not task.cancelled() and task.exception() is not None:
+            logger.error(f"Buffered write flush failed: {task.exception()!r}")
+
+    def pending(self) -> asyncio.Future:
+        """Get a future that is done once everything buffered so far was sent."""
+        loop = asyncio.get_running_loop()
+        if self._size:
+            if self._flushed is None:
+                self._flushed = loop.create_future()
+            return self._flushed
+        if self._sending is not None:
+            return self._sending
+        future = loop.create_future()
+        future.set_result(None)
+        return future
+
+    async def flush(self) -> int:
+        """Send every buffered operation, returning how many of them failed."""
+        async with self._lock:
+            operations, self._operations = self._operations, {}
+            callbacks, self._callbacks = self._callbacks, []
+            self._sending = self._flushed or asyncio.get_running_loop().create_future()
+            self._flushed = None
+            self._size = 0
+            try:
+                return await self._send(operations, callbacks)
+            finally:
+                if not self._sending.done():
+                    self._sending.set_result(None)
+                self._sending = None
+
+    async def _send(self, operations: dict[str, list], callbacks: list) -> int:
+        """Bulk write the given operations and run their callbacks."""
+        if not operations:
+            return 0
+
+        start = time.monotonic()
+        results = await asyncio.gather(
+            *[
+                self._write(name, ops[i : i + WRITE_BUFFER_MAX_OPS])
+                for name, ops in operations.items()
+                for i in range(0, len(ops), WRITE_BUFFER_MAX_OPS)
+            ]
+        )
+        for callback in callbacks:
+            try:
+                callback()
+            except Exception as e:
+                logger.error(f"Buffered write callback failed: {e!r}")
+
+        self.flushes += 1
+        failed = sum(results)
+        logger.debug(
+            f"Flushed {sum(len(i) for i in operations.values())} writes to "
+            f"{len(operations)} collections in "
+            f"{(time.monotonic() - start) * 1000:.1f}ms ({failed} failed)"
+        )
+        return failed
+
+    async def _write(self, name: str, operations: list) -> int:
+        """Bulk write one batch, logging every operation that failed."""
+        self.batches += 1
+        try:
+            result = await self._collections[name].bulk_write(operations, ordered=False)
+            self.written += result.modified_count + result.upserted_count
+            return 0
+        except errors.BulkWriteError as e:
+            write_errors = e.details.get("writeErrors", [])
+            for error in write_errors:
+                logger.error(
+                    f"Buffered write to {name} failed: "
+                    f"{operations[error['index']]} ({error['errmsg']})"
+                )
+            self.written += e.details.get("nModified", 0)
+            self.failed += len(write_errors)
+            return len(write_errors)
+        except errors.PyMongoError as e:
+            logger.error(f"Buffered writes to {name} failed: {e}")
+            self.failed += len(operations)
+            return len(operations)
+
+    async def run(self) -> None:
+        """Flush buffered writes periodically until cancelled."""
+        while True:
+            await asyncio.sleep(WRITE_BUFFER_FLUSH_INTERVAL)
+            try:
+                await self.flush()
+            except Exception as e:
+                logger.error(f"Buffered write flush failed: {e!r}")
+
+    async def start(self) -> None:
+        """Start flushing buffered writes in the background."""
+        if not self._task:
+            self._task = asyncio.create_task(self.run())
+
+    async def stop(self) -> None:
+        """Stop the background flush and send whatever is still buffered."""
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await self.flush()
+
+    def stats(self) -> dict:
+        """Get how many writes were buffered, batched and failed."""
+        return {
+            "buffered": self._size,
+            "flushes": self.flushes,
+            "batches": self.batches,
+            "written": self.written,
+            "failed": self.failed,
+        }
+
+
+write_buffer = WriteBuffer()
@@ -0,0 +1,78 @@
+"""Times ranking parties for a user with the genre index at scale.
+
+Run from the repository root with: python -m benchmarks.bench_genre_index
+
+Builds an index of PARTIES public parties tagged from a synthetic genre
+vocabulary and times a full first page and a follow-up page of matches.
+"""
+
+import os
+import random
+import time
+import timeit
+
+os.environ.setdefault("MONGODB_CONNECTION_STR", "mongodb://localhost:27017")
+os.environ.setdefault("SPOTIFY_CLIENT_ID", "client-id")
+os.environ.setdefault("SPOTIFY_CLIENT_SECRET", "client-secret")
+
+from SpartyTime.backend.utils.genre_index import (  # noqa: E402
+    GenreIndex,
+    rank_weights,
+)
+from SpartyTime.backend.utils.party_registry import PartyRecord  # noqa: E402
+
+PARTIES = 100_000
+GENRES = 2000
+PROFILE_GENRES = 20
+LIMIT = 20
+NUMBER = 50
+
+
+def build_index(rng: random.Random) -> GenreIndex:
+    vocabulary = [f"genre-{i}" for i in range(GENRES)]
+    index = GenreIndex()
+    for i in range(PARTIES):
+        party_id = f"{i:024x}"
+        index.apply(
+            party_id,
+            None,
+            PartyRecord(
+                party_id,
+                f"owner-{i}",
+                (f"owner-{i}", f"user-{i % 5000}"),
+                "public",
+                tuple(rng.sample(vocabulary, 5)),
+            ),
+        )
+    return index
+
+
+def bench(name: str, func) -> None:
+    seconds = min(timeit.repeat(func, number=NUMBER, repeat=5)) / NUMBER
+    print(f"  {name:<28} {seconds * 1e3:9.2f} ms")
+
+
+def main() -> None:
+    rng = random.Random(0)
+    started = time.perf_counter()
+    index = build_index(rng)
+    print(
+        f"indexed {len(index)} parties in {time.perf_counter() - started:.1f} s "
+        f"({GENRES} genres, profile of {PROFILE_GENRES}, limit {LIMIT})"
+    )
+
+    weights = rank_weights(
+        rng.sample([f"genre-{i}" for i in range(GENRES)], PROFILE_GENRES)
+    )
+    first = index.match(weights, "user-1", limit=LIMIT + 1)
+    assert first == index.match(weights, "user-1")[: LIMIT + 1]
+
+    bench("first page", lambda: index.match(weights, "user-1", limit=LIMIT + 1))
+    bench(
+        "next page",
+        lambda: index.match(weights, "user-1", limit=LIMIT + 1, after=first[LIMIT - 1]),
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,147 @@
+"""Compares Spotify payload parsing before and after parsing straight into dicts.
+
+Run from the repository root with: python -m benchmarks.bench_spotify_parsing
+
+The payloads in benchmarks/payloads are synthetic, not recorded from Spotify.
+They follow the documented shape of the currently playing, queue and recently
+played responses, with made up ids and names. The model based parsers below are
+the implementations the dict parsers replaced, kept here only to measure against.
+
+Decoding is timed the way each version reads a response: resp.json() decodes the
+body to str and passes it to json.loads, read_json passes the raw bytes to
+orjson.
+"""
+
+import json
+import os
+import pathlib
+import timeit
+
+from pydantic import BaseModel
+
+os.environ.setdefault("MONGODB_CONNECTION_STR", "mongodb://localhost:27017")
+os.environ.setdefault("SPOTIFY_CLIENT_ID", "client-id")
+os.environ.setdefault("SPOTIFY_CLIENT_SECRET", "client-secret")
+
+from SpartyTime.backend.utils.spotify_handler import (  # noqa: E402
+    json_loads,
+    parse_currently_playing,
+    parse_items_json,
+)
+
+PAYLOADS = pathlib.Path(__file__).parent / "payloads"
+NUMBER = 2000
+
+
+class Artist(BaseModel):
+    name: str
+    uri: str
+
+
+class Album(BaseModel):
+    name: str
+    uri: str
+    image: str
+
+
+class ParsedItem(BaseModel):
+    name: str
+    uri: str
+    album: Album
+    artists: list[Artist]
+
+
+class CurrentlyPlaying(BaseModel):
+    is_playing: bool
+    progress_ms: int
+    duration_ms: int
+    name: str
+    uri: str
+    album: Album
+    artists: list
+
+
+def parse_items_models(items: dict, type: str = "recent") -> list[dict]:
+    """The model based parser, including the model_dump its callers did."""
+    parse_with = "queue" if type == "queue" else "items"
+    parsed = []
+    for item in items[parse_with]:
+        track = item if type != "recent" else item["track"]
+        parsed.append(
+            ParsedItem(
+                name=track["name"],
+                uri=track["uri"].split(":")[2],
+                album=Album(
+                    name=track["album"]["name"],
+                    uri=track["album"]["uri"].split(":")[2],
+                    image=track["album"]["images"][0]["url"],
+                ),
+                artists=[
+                    Artist(name=artist["name"], uri=artist["uri"].split(":")[2])
+                    for artist in track["artists"]
+                ],
+            ).model_dump()
+        )
+    return parsed
+
+
+def parse_currently_playing_models(resp_json: dict) -> dict:
+    """The model based currently playing parser, run on every party tick."""
+    return CurrentlyPlaying(
+        is_playing=resp_json["is_playing"],
+        progress_ms=resp_json["progress_ms"],
+        duration_ms=resp_json["item"]["duration_ms"],
+        name=resp_json["item"]["name"],
+        uri=resp_json["item"]["uri"],
+        album=Album(
+            name=resp_json["item"]["album"]["name"],
+            uri=resp_json["item"]["album"]["uri"],
+            image=resp_json["item"]["album"]["images"][0]["url"],
+        ),
+        artists=[
+            Artist(name=artist["name"], uri=artist["uri"])
+            for artist in resp_json["item"]["artists"]
+        ],
+    ).model_dump()
+
+
+def bench(name: str, func) -> float:
+    seconds = min(timeit.repeat(func, number=NUMBER, repeat=5)) / NUMBER
+    print(f"  {name:<28} {seconds * 1e6:9.1f} us")
+    return seconds
+
+
+def main() -> None:
+    print(f"json decoder: {json_loads.__module__}")
+    parsers = (
+        (
+            "currently_playing.json",
+            parse_currently_playing_models,
+            parse_currently_playing,
+        ),
+        (
+            "queue.json",
+            lambda i: parse_items_models(i, "queue"),
+            lambda i: parse_items_json(i, "queue"),
+        ),
+        ("recently_played.json", parse_items_models, parse_items_json),
+    )
+    for payload, parse_models, parse_json in parsers:
+        raw = (PAYLOADS / payload).read_bytes()
+        decoded = json.loads(raw)
+        assert parse_json(decoded) == parse_models(decoded)
+
+        print(f"{payload} ({len(raw)} bytes)")
+        old_decode = bench("resp.json()", lambda: json.loads(raw.decode()))
+        new_decode = bench("read_json", lambda: json_loads(raw))
+        old_parse = bench("model parser", lambda: parse_models(decoded))
+        new_parse = bench("dict parser", lambda: parse_json(decoded))
+        print(
+            f"  speedup: decode {old_decode / new_decode:.1f}x, "
+            f"parse {old_parse / new_parse:.1f}x, "
+            f"total {(old_decode + old_parse) / (new_decode + new_parse):.1f}x"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,45 @@
+import os
+import types
+
+import pytest
+from mongomock_motor import AsyncMongoMockClient
+
+os.environ.setdefault("MONGODB_CONNECTION_STR", "mongodb://localhost:27017")
+os.environ.setdefault("SPOTIFY_CLIENT_ID", "client-id")
+os.environ.setdefault("SPOTIFY_CLIENT_SECRET", "client-secret")
+os.environ.setdefault("SECRET", "secret")
+
+from SpartyTime.backend.utils import database_handler  # noqa: E402
+
+
+class Clock:
+    """Wall clock stand-in that only moves when told to."""
+
+    def __init__(self, now: float = 1_000_000.0):
+        self.now = now
+
+    def time(self) -> float:
+        return self.now
+
+    def advance(self, seconds: float) -> None:
+        self.now += seconds
+
+
+@pytest.fixture
+def clock(monkeypatch) -> Clock:
+    clock = Clock()
+    monkeypatch.setattr(
+        database_handler, "time", types.SimpleNamespace(time=clock.time)
+    )
+    return clock
+
+
+@pytest.fixture
+def mongo(monkeypatch):
+    client = AsyncMongoMockClient()
+    monkeypatch.setattr(database_handler, "client", client, raising=False)
+    monkeypatch.setattr(database_handler, "users_db", client["users"], raising=False)
+    monkeypatch.setattr(
+        database_handler, "parties_db", client["parties"], raising=False
+    )
+    return client
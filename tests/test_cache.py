@@ -0,0 +1,84 @@
+import asyncio
+
+import pytest
+
+from SpartyTime.backend.utils.cache import SingleFlight
+
+
+class Counter:
+    """Call stand-in counting how often it ran."""
+
+    def __init__(self, result=None, error: Exception = None):
+        self.result = result
+        self.error = error
+        self.calls = 0
+
+    async def __call__(self):
+        self.calls += 1
+        await asyncio.sleep(0.01)
+        if self.error:
+            raise self.error
+        return self.result
+
+
+@pytest.mark.asyncio
+async def test_concurrent_callers_share_one_call():
+    flight = SingleFlight()
+    call = Counter("result")
+
+    results = await asyncio.gather(*[flight.run("key", call) for _ in range(3)])
+
+    assert results == ["result"] * 3
+    assert call.calls == 1
+    assert flight.stats()["coalesced"] == 2
+
+
+@pytest.mark.asyncio
+async def test_errors_reach_every_waiter():
+    flight = SingleFlight()
+    call = Counter(error=ValueError("failed"))
+
+    results = await asyncio.gather(
+        *[flight.run("key", call) for _ in range(2)], return_exceptions=True
+    )
+
+    assert call.calls == 1
+    assert all(isinstance(i, ValueError) for i in results)
+
+
+@pytest.mark.asyncio
+async def test_a_cancelled_waiter_does_not_cancel_the_shared_call():
+    flight = SingleFlight()
+    call = Counter("result")
+
+    first = asyncio.create_task(flight.run("key", call))
+    second = asyncio.create_task(flight.run("key", call))
+    await asyncio.sleep(0)
+    first.cancel()
+
+    assert await second == "result"
+    assert call.calls == 1
+
+
+@pytest.mark.asyncio
+async def test_results_are_reused_within_the_ttl():
+    flight = SingleFlight(ttl=60)
+    call = Counter("result")
+
+    await flight.run("key", call)
+    assert await flight.run("key", call) == "result"
+
+    assert call.calls == 1
+    assert flight.stats()["cache_hits"] == 1
+
+
+@pytest.mark.asyncio
+async def test_failures_are_not_cached():
+    flight = SingleFlight(ttl=60)
+    call = Counter(error=ValueError("failed"))
+
+    for _ in range(2):
+        with pytest.raises(ValueError):
+            await flight.run("key", call)
+
+    assert call.calls == 2
@@ -0,0 +1,158 @@
+import types
+
+import pytest
+from bson.objectid import ObjectId
+
+from SpartyTime.backend.utils import database_handler
+from SpartyTime.backend.utils.database_handler import diff_documents, prepended_items
+
+
+def test_prepended_items_detects_a_shifted_list():
+    assert prepended_items([1, 2, 3], [0, 1, 2]) == [0]
+    assert prepended_items([1, 2, 3], [-1, 0, 1]) == [-1, 0]
+    assert prepended_items([1, 2, 3], [0, 1, 2, 3]) == [0]
+
+
+def test_prepended_items_rejects_changed_lists():
+    assert prepended_items([1, 2, 3], [0, 9, 2]) is None
+    assert prepended_items([1, 2, 3], [1, 2, 3]) is None
+    assert prepended_items([1, 2, 3], [7, 8, 9]) is None
+
+
+def test_unchanged_documents_need_no_update():
+    document = {"party_info": {"users": ["a"]}, "party_data": {"history": [1]}}
+    assert diff_documents(document, document) == {}
+
+
+def test_nested_fields_are_set_and_unset_individually():
+    old = {"party_data": {"is_playing": True, "queue": [1], "extra": 1}}
+    new = {"party_data": {"is_playing": False, "queue": [1], "current_song": {}}}
+
+    assert diff_documents(old, new) == {
+        "$set": {
+            "party_data.is_playing": False,
+            "party_data.current_song": {},
+        },
+        "$unset": {"party_data.extra": ""},
+    }
+
+
+def test_prepended_history_is_pushed_and_trimmed_to_its_length():
+    old = {"party_data": {"history": [3, 2, 1]}}
+    new = {"party_data": {"history": [5, 4, 3]}}
+
+    assert diff_documents(old, new) == {
+        "$push": {"party_data.history": {"$each": [5, 4], "$position": 0, "$slice": 3}}
+    }
+
+
+def test_history_with_a_changed_prefix_is_set():
+    old = {"party_data": {"history": [3, 2, 1]}}
+    new = {"party_data": {"history": [4, 9, 2]}}
+
+    assert diff_documents(old, new) == {"$set": {"party_data.history": [4, 9, 2]}}
+
+
+def test_only_history_lists_are_pushed():
+    old = {"party_data": {"queue": [2, 1]}}
+    new = {"party_data": {"queue": [3, 2]}}
+
+    assert diff_documents(old, new) == {"$set": {"party_data.queue": [3, 2]}}
+
+
+@pytest.fixture
+def user_cache(monkeypatch):
+    monkeypatch.setattr(database_handler, "USER_CACHE_ENABLED", True)
+    database_handler.user_cache.clear()
+    database_handler.spotify_user_ids.clear()
+    yield database_handler.user_cache
+    database_handler.user_cache.clear()
+    database_handler.spotify_user_ids.clear()
+
+
+async def insert_user(mongo) -> str:
+    user = {
+        "_id": ObjectId(),
+        "username": "user",
+        "spotify_id": "spotify-user",
+        "spotify_data": {},
+        "spotify_session_data": {
+            "access_token": "token",
+            "token_type": "Bearer",
+            "expires_in": 3600,
+            "scope": "",
+            "refresh_token": "refresh",
+        },
+    }
+    await mongo["users"].auth_details.insert_one(user)
+    return str(user["_id"])
+
+
+@pytest.mark.asyncio
+async def test_users_are_read_once_then_served_from_the_cache(mongo, user_cache):
+    user_id = await insert_user(mongo)
+
+    first = await database_handler.get_user_by_id(user_id)
+    await mongo["users"].auth_details.update_one(
+        {"_id": ObjectId(user_id)}, {"$set": {"username": "renamed"}}
+    )
+
+    assert await database_handler.get_user_by_id(user_id) is first
+    assert user_cache.hits == 1
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize(
+    "write",
+    [
+        lambda user_id: database_handler.update_user(user_id, {"genres": ["pop"]}),
+        lambda user_id: database_handler.update_session(user_id, {}),
+        lambda user_id: database_handler.set_user_party(user_id, "party"),
+        lambda user_id: database_handler.remove_party_member(
+            "65f0c0ffee0000000000beef", user_id
+        ),
+    ],
+)
+async def test_writes_invalidate_the_cached_user(mongo, user_cache, write):
+    user_id = await insert_user(mongo)
+    await database_handler.get_user_by_id(user_id)
+
+    await write(user_id)
+
+    assert ObjectId(user_id) not in user_cache
+
+
+@pytest.mark.asyncio
+async def test_reads_overlapping_an_invalidation_are_not_cached(
+    mongo, user_cache, monkeypatch
+):
+    user_id = await insert_user(mongo)
+    collection = mongo["users"].auth_details
+
+    async def find_one(query):
+        document = await collection.find_one(query)
+        database_handler.invalidate_user(user_id)
+        return document
+
+    monkeypatch.setattr(
+        database_handler,
+        "users_db",
+        types.SimpleNamespace(auth_details=types.SimpleNamespace(find_one=find_one)),
+    )
+    await database_handler.get_user_by_id(user_id)
+
+    assert len(user_cache) == 0
+
+
+@pytest.mark.asyncio
+async def test_disabled_cache_reads_every_time(mongo, user_cache, monkeypatch):
+    monkeypatch.setattr(database_handler, "USER_CACHE_ENABLED", False)
+    user_id = await insert_user(mongo)
+
+    await database_handler.get_user_by_id(user_id)
+    await mongo["users"].auth_details.update_one(
+        {"_id": ObjectId(user_id)}, {"$set": {"username": "renamed"}}
+    )
+
+    assert (await database_handler.get_user_by_id(user_id)).username == "renamed"
+    assert len(user_cache) == 0
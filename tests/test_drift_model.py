@@ -0,0 +1,90 @@
+import types
+
+import pytest
+
+from SpartyTime.backend.utils import drift_model
+from SpartyTime.backend.utils.drift_model import (
+    SYNC_DRIFT_THRESHOLD_MS,
+    PlaybackSample,
+    needs_seek,
+    playback_drift,
+    sample_playback,
+    seek_position,
+)
+
+
+@pytest.fixture
+def now(monkeypatch):
+    """Pin the monotonic clock of the drift model to 100 seconds."""
+    monkeypatch.setattr(
+        drift_model, "time", types.SimpleNamespace(monotonic=lambda: 100.0)
+    )
+    return 100.0
+
+
+def sample(
+    progress_ms: int,
+    sampled_at: float = 100.0,
+    rtt_ms: float = 0,
+    uri: str = "spotify:track:a",
+    is_playing: bool = True,
+) -> PlaybackSample:
+    data = {
+        "is_playing": is_playing,
+        "progress_ms": progress_ms,
+        "duration_ms": 200_000,
+        "uri": uri,
+    }
+    return PlaybackSample(data, sampled_at, rtt_ms)
+
+
+def test_sample_is_stamped_with_the_midpoint_of_the_exchange():
+    playback = sample_playback({"is_playing": True}, 10.0, 10.2)
+
+    assert playback.sampled_at == pytest.approx(10.1)
+    assert playback.rtt_ms == pytest.approx(200)
+
+
+def test_position_is_extrapolated_while_playing():
+    assert sample(5_000, sampled_at=98.5).position_at(100.0) == 6_500
+
+
+def test_paused_position_stays_put():
+    assert sample(5_000, sampled_at=90.0, is_playing=False).position_at(100.0) == 5_000
+
+
+def test_drift_compares_both_positions_at_the_same_time(now):
+    owner = sample(10_000, sampled_at=99.0)
+    member = sample(10_500, sampled_at=99.5)
+
+    assert playback_drift(owner, member) == 0
+
+
+def test_drift_is_none_for_different_songs(now):
+    assert playback_drift(sample(0), sample(0, uri="spotify:track:b")) is None
+    assert needs_seek(sample(0), sample(0, uri="spotify:track:b"))
+
+
+@pytest.mark.parametrize(
+    "drift_ms, seek",
+    [
+        (SYNC_DRIFT_THRESHOLD_MS - 1, False),
+        (SYNC_DRIFT_THRESHOLD_MS, False),
+        (SYNC_DRIFT_THRESHOLD_MS + 1, True),
+        (-SYNC_DRIFT_THRESHOLD_MS, False),
+        (-SYNC_DRIFT_THRESHOLD_MS - 1, True),
+    ],
+)
+def test_needs_seek_only_past_the_threshold(now, drift_ms, seek):
+    assert needs_seek(sample(50_000), sample(50_000 + drift_ms)) is seek
+
+
+def test_seek_position_adds_half_the_member_round_trip(now):
+    owner = sample(30_000, sampled_at=99.0)
+    member = sample(0, rtt_ms=300)
+
+    assert seek_position(owner, member) == 31_150
+
+
+def test_seek_position_is_clamped_to_the_track_length(now):
+    assert seek_position(sample(199_900), sample(0, rtt_ms=1_000)) == 200_000
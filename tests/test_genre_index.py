@@ -0,0 +1,75 @@
+from SpartyTime.backend.utils.genre_index import GenreIndex
+from SpartyTime.backend.utils.party_registry import PartyRecord
+
+
+def party(party_id: str, genres: tuple, users: tuple = (), type: str = "public"):
+    return PartyRecord(party_id, "owner", users, type, genres)
+
+
+def build(*records: PartyRecord) -> GenreIndex:
+    index = GenreIndex(capacity=2)
+    for record in records:
+        index.apply(record.party_id, None, record)
+    return index
+
+
+def test_equal_scores_are_ordered_by_party_id():
+    index = build(
+        party("c", ("rock",)),
+        party("a", ("rock",)),
+        party("b", ("rock",)),
+        party("d", ("rock", "pop")),
+    )
+
+    ranked = index.match({"rock": 1.0})
+
+    assert [party_id for party_id, _ in ranked] == ["a", "b", "c", "d"]
+    assert ranked[0][1] == ranked[2][1] > ranked[3][1]
+
+
+def test_limit_keeps_the_id_order_across_a_tied_cutoff():
+    index = build(*[party(i, ("rock",)) for i in "edcba"])
+
+    assert [i for i, _ in index.match({"rock": 1.0}, limit=2)] == ["a", "b"]
+
+
+def test_after_continues_from_the_last_pair_of_a_page():
+    index = build(
+        party("a", ("rock",)),
+        party("b", ("rock",)),
+        party("c", ("rock", "pop")),
+        party("d", ("pop",)),
+    )
+
+    first = index.match({"rock": 1.0}, limit=2)
+    second = index.match({"rock": 1.0}, limit=2, after=first[-1])
+
+    assert [i for i, _ in first] == ["a", "b"]
+    assert [i for i, _ in second] == ["c"]
+
+
+def test_unrelated_private_and_joined_parties_are_left_out():
+    index = build(
+        party("a", ("rock",), users=("u1",)),
+        party("b", ("rock",), type="unlisted"),
+        party("c", ("jazz",)),
+        party("d", ("rock",)),
+    )
+
+    assert [i for i, _ in index.match({"rock": 1.0}, "u1")] == ["d"]
+
+
+def test_retagged_and_removed_parties_leave_their_old_genres():
+    index = build(party("a", ("rock",)), party("b", ("jazz",)))
+
+    index.apply("a", None, party("a", ("pop",)))
+    index.remove("b")
+    index.apply("c", None, party("c", ("soul",)))
+
+    assert index.match({"rock": 1.0}) == []
+    assert index.match({"jazz": 1.0}) == []
+    assert [i for i, _ in index.match({"pop": 1.0, "soul": 1.0})] == ["a", "c"]
+    assert index._postings.keys() == {
+        index._vocabulary["pop"],
+        index._vocabulary["soul"],
+    }
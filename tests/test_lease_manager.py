@@ -0,0 +1,183 @@
+import pytest
+
+from SpartyTime.backend.utils import lease_manager as lease_module
+from SpartyTime.backend.utils.database_handler import (
+    acquire_party_lease,
+    heartbeat_sync_worker,
+    release_party_lease,
+)
+from SpartyTime.backend.utils.lease_manager import HashRing, LeaseManager
+
+TTL = lease_module.LEASE_TTL
+PARTIES = [f"{i:024x}" for i in range(64)]
+
+
+def make_worker(worker_id: str) -> LeaseManager:
+    manager = LeaseManager()
+    manager.worker_id = worker_id
+    manager.ring = HashRing([worker_id])
+    return manager
+
+
+@pytest.mark.asyncio
+async def test_acquire_and_renew(mongo, clock):
+    assert await acquire_party_lease("party", "w1", TTL)
+    lease = await mongo["parties"].sync_leases.find_one({"_id": "party"})
+    assert lease["owner"] == "w1"
+    assert lease["expires_at"] == clock.now + TTL
+
+    clock.advance(TTL / 2)
+    assert await acquire_party_lease("party", "w1", TTL)
+    lease = await mongo["parties"].sync_leases.find_one({"_id": "party"})
+    assert lease["owner"] == "w1"
+    assert lease["expires_at"] == clock.now + TTL
+
+
+@pytest.mark.asyncio
+async def test_live_lease_of_another_worker_is_refused(mongo, clock):
+    assert await acquire_party_lease("party", "w1", TTL)
+    clock.advance(TTL - 1)
+
+    assert not await acquire_party_lease("party", "w2", TTL)
+    lease = await mongo["parties"].sync_leases.find_one({"_id": "party"})
+    assert lease["owner"] == "w1"
+
+
+@pytest.mark.asyncio
+async def test_expired_lease_is_taken_over(mongo, clock):
+    assert await acquire_party_lease("party", "w1", TTL)
+    clock.advance(TTL + 1)
+
+    assert await acquire_party_lease("party", "w2", TTL)
+    lease = await mongo["parties"].sync_leases.find_one({"_id": "party"})
+    assert lease["owner"] == "w2"
+    assert not await acquire_party_lease("party", "w1", TTL)
+
+
+@pytest.mark.asyncio
+async def test_released_lease_is_free(mongo, clock):
+    assert await acquire_party_lease("party", "w1", TTL)
+    await release_party_lease("party", "w2")
+    assert not await acquire_party_lease("party", "w2", TTL)
+
+    await release_party_lease("party", "w1")
+    assert await acquire_party_lease("party", "w2", TTL)
+
+
+@pytest.mark.asyncio
+async def test_held_leases_are_renewed_together(mongo, clock, monkeypatch):
+    worker = make_worker("w1")
+    await worker.rebalance(PARTIES)
+    assert worker.owned == set(PARTIES)
+
+    async def acquire(*args):
+        raise AssertionError("held lease acquired again")
+
+    monkeypatch.setattr(lease_module, "acquire_party_lease", acquire)
+    clock.advance(TTL / 2)
+    await worker.rebalance(PARTIES)
+    assert worker.owned == set(PARTIES)
+    async for lease in mongo["parties"].sync_leases.find():
+        assert lease["expires_at"] == clock.now + TTL
+
+
+@pytest.mark.asyncio
+async def test_lease_taken_over_while_stalled_is_dropped(mongo, clock):
+    worker = make_worker("w1")
+    await worker.rebalance(PARTIES)
+
+    clock.advance(TTL + 1)
+    assert await acquire_party_lease(PARTIES[0], "w2", TTL)
+    await worker.rebalance(PARTIES)
+    assert worker.owned == set(PARTIES[1:])
+
+
+@pytest.mark.asyncio
+async def test_workers_split_parties_without_overlap(mongo, clock):
+    first, second = make_worker("w1"), make_worker("w2")
+    await heartbeat_sync_worker("w2")
+
+    await first.rebalance(PARTIES)
+    await second.rebalance(PARTIES)
+
+    assert first.owned and second.owned
+    assert not first.owned & second.owned
+    assert first.owned | second.owned == set(PARTIES)
+
+
+@pytest.mark.asyncio
+async def test_parties_move_when_a_worker_disappears(mongo, clock):
+    first, second = make_worker("w1"), make_worker("w2")
+    await heartbeat_sync_worker("w2")
+    await first.rebalance(PARTIES)
+    await second.rebalance(PARTIES)
+    kept = set(first.owned)
+    orphaned = set(second.owned)
+
+    # w2 stops heartbeating, w1 keeps going but leaves its parties alone while
+    # w2 is still considered live
+    clock.advance(TTL / 2)
+    await first.rebalance(PARTIES)
+    assert first.ring.nodes == ["w1", "w2"]
+    assert first.owned == kept
+    assert not orphaned & first.owned
+
+    # once w2 misses its heartbeat TTL, its leases have expired as well
+    clock.advance(TTL / 2 + 1)
+    await first.rebalance(PARTIES)
+    assert first.ring.nodes == ["w1"]
+    assert first.owned == set(PARTIES)
+
+
+@pytest.mark.asyncio
+async def test_stopped_worker_hands_back_its_leases(mongo, clock):
+    first, second = make_worker("w1"), make_worker("w2")
+    await heartbeat_sync_worker("w2")
+    await first.rebalance(PARTIES)
+    await second.rebalance(PARTIES)
+
+    await second.stop()
+    await first.rebalance(PARTIES)
+    assert first.owned == set(PARTIES)
+
+
+@pytest.mark.asyncio
+async def test_workers_split_users_without_overlap(mongo, clock):
+    first, second = make_worker("w1"), make_worker("w2")
+    await heartbeat_sync_worker("w2")
+    await first.rebalance([])
+    await second.rebalance([])
+
+    users = [f"{i:024x}" for i in range(1000, 1064)]
+    for user_id in users:
+        assert first.assigned(user_id) != second.assigned(user_id)
+    assert any(first.assigned(i) for i in users)
+
+
+def test_hash_ring_moves_only_the_parties_of_a_removed_worker():
+    before = HashRing(["w1", "w2", "w3"])
+    after = HashRing(["w1", "w3"])
+
+    for party_id in PARTIES:
+        if before.node_for(party_id) != "w2":
+            assert after.node_for(party_id) == before.node_for(party_id)
+        else:
+            assert after.node_for(party_id) in ("w1", "w3")
+
+
+@pytest.mark.asyncio
+async def test_live_leases_of_a_dropped_worker_wait_for_expiry(mongo, clock):
+    first, second = make_worker("w1"), make_worker("w2")
+    await heartbeat_sync_worker("w2")
+    await first.rebalance(PARTIES)
+    await second.rebalance(PARTIES)
+    orphaned = set(second.owned)
+
+    await mongo["parties"].sync_workers.delete_one({"_id": "w2"})
+    await first.rebalance(PARTIES)
+    assert first.ring.nodes == ["w1"]
+    assert not orphaned & first.owned
+
+    clock.advance(TTL + 1)
+    await first.rebalance(PARTIES)
+    assert first.owned == set(PARTIES)
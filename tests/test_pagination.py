@@ -0,0 +1,72 @@
+import base64
+
+import pytest
+from bson.objectid import ObjectId
+
+from SpartyTime.backend.utils.discovery_service import list_parties, match_parties
+from SpartyTime.backend.utils.pagination import (
+    InvalidCursor,
+    decode_cursor,
+    encode_cursor,
+)
+
+
+def test_cursor_round_trips_the_position():
+    position = ["65f0c0ffee0000000000beef", 0.5]
+    assert decode_cursor(encode_cursor(position)) == position
+
+
+@pytest.mark.parametrize(
+    "cursor",
+    [
+        "not base64!",
+        base64.urlsafe_b64encode(b"{not json").decode(),
+        base64.urlsafe_b64encode(b'{"a": 1}').decode(),
+    ],
+)
+def test_malformed_cursors_raise_invalid_cursor(cursor):
+    with pytest.raises(InvalidCursor):
+        decode_cursor(cursor)
+
+
+def party(name: str) -> dict:
+    return {
+        "_id": ObjectId(),
+        "party_info": {
+            "party_name": name,
+            "party_description": "",
+            "genres": ["rock"],
+            "type": "public",
+        },
+    }
+
+
+@pytest.mark.asyncio
+async def test_parties_are_listed_page_by_page(mongo):
+    await mongo["parties"].party_details.insert_many([party(str(i)) for i in range(5)])
+
+    names, cursor = [], None
+    while True:
+        page = await list_parties(2, cursor)
+        names += [i["party_info"]["party_name"] for i in page["parties"]]
+        cursor = page["next_cursor"]
+        if not cursor:
+            break
+
+    assert names == ["0", "1", "2", "3", "4"]
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize(
+    "position", [["not an id"], [1], ["65f0c0ffee0000000000beef", 1]]
+)
+async def test_list_cursors_must_hold_a_party_id(mongo, position):
+    with pytest.raises(InvalidCursor):
+        await list_parties(2, encode_cursor(position))
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("position", [["a"], [1, "a"], ["a", "0.5"]])
+async def test_match_cursors_must_hold_a_party_id_and_score(position):
+    with pytest.raises(InvalidCursor):
+        await match_parties("user", 2, encode_cursor(position))
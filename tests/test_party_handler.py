@@ -0,0 +1,98 @@
+import pytest
+from bson.objectid import ObjectId
+
+from SpartyTime.backend.utils import party_handler
+from SpartyTime.backend.utils.database_handler import PartyModel
+from SpartyTime.backend.utils.party_handler import get_party_artists
+
+
+@pytest.fixture
+def lookups(monkeypatch):
+    """Record which owner's token each artist chunk was fetched with."""
+    calls = []
+
+    async def get_token(user_id):
+        if user_id == "revoked":
+            raise ValueError("refresh failed")
+        return f"token-{user_id}"
+
+    async def get_several_artists(token, uris):
+        calls.append((token, len(uris)))
+        return {
+            "artists": [
+                {"id": uri, "genres": ["pop"]} if uri != "unknown" else None
+                for uri in uris
+            ]
+        }
+
+    monkeypatch.setattr(party_handler.token_manager, "get_token", get_token)
+    monkeypatch.setattr(party_handler, "get_several_artists", get_several_artists)
+    monkeypatch.setattr(party_handler, "SPOTIFY_IDS_PER_REQUEST", 2)
+    return calls
+
+
+@pytest.mark.asyncio
+async def test_chunks_are_spread_over_the_owners(lookups):
+    artists = await get_party_artists(["a", "b"], ["1", "2", "3", "4", "5"])
+
+    assert set(artists) == {"1", "2", "3", "4", "5"}
+    assert lookups == [("token-a", 2), ("token-b", 2), ("token-a", 1)]
+
+
+@pytest.mark.asyncio
+async def test_a_revoked_owner_falls_back_to_the_next_one(lookups):
+    artists = await get_party_artists(["revoked", "b"], ["1", "2", "3"])
+
+    assert set(artists) == {"1", "2", "3"}
+    assert {token for token, _ in lookups} == {"token-b"}
+
+
+@pytest.mark.asyncio
+async def test_chunks_failing_for_every_owner_are_left_out(lookups):
+    assert await get_party_artists(["revoked"], ["1", "2"]) == {}
+
+
+@pytest.mark.asyncio
+async def test_artists_spotify_did_not_return_are_left_out(lookups):
+    assert set(await get_party_artists(["a"], ["1", "unknown"])) == {"1"}
+
+
+def party_with_history(*artist_uris: str) -> PartyModel:
+    return PartyModel(
+        id=ObjectId(),
+        party_info={
+            "party_name": "party",
+            "party_description": "",
+            "genres": ["rock"],
+            "start": 0,
+            "users": [],
+            "owner": "a",
+            "type": "public",
+        },
+        party_data={
+            "is_playing": True,
+            "current_song": {},
+            "time_since_last_played": 0,
+            "queue": [],
+            "history": [{"artists": [{"uri": uri} for uri in artist_uris]}],
+        },
+    )
+
+
+@pytest.mark.asyncio
+async def test_parties_with_missing_artists_keep_their_genres(lookups, monkeypatch):
+    complete = party_with_history("1", "2")
+    partial = party_with_history("1", "unknown")
+    changed = []
+
+    async def get_parties(filter_dict):
+        return [complete, partial]
+
+    monkeypatch.setattr(party_handler, "get_parties", get_parties)
+    monkeypatch.setattr(party_handler, "queue_party_changes", changed.append)
+
+    await party_handler.update_party_genres([complete.id, partial.id])
+
+    assert changed == [complete]
+    assert complete.party_info.genres == ["pop"]
+    assert partial.party_info.genres == ["rock"]
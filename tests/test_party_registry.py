@@ -0,0 +1,199 @@
+import asyncio
+from contextlib import asynccontextmanager
+
+import pytest
+from pymongo import errors
+
+from SpartyTime.backend.utils import party_registry
+from SpartyTime.backend.utils.party_registry import PartyRegistry
+
+
+async def no_changes():
+    await asyncio.Event().wait()
+    yield
+
+
+def failing_stream(*failures):
+    """Change stream stand-in raising the given errors, then staying open."""
+    failures = list(failures)
+    opened = []
+
+    @asynccontextmanager
+    async def watch():
+        if failures:
+            raise failures.pop(0)
+        opened.append(True)
+        yield no_changes()
+
+    watch.opened = opened
+    return watch
+
+
+@pytest.fixture(autouse=True)
+def fast_backoff(monkeypatch):
+    async def documents():
+        return [{"_id": "p1", "party_info": {"owner": "u1"}}]
+
+    monkeypatch.setattr(party_registry, "PARTY_REGISTRY_POLL_INTERVAL", 0)
+    monkeypatch.setattr(party_registry, "get_party_registry_documents", documents)
+
+
+async def run_briefly(registry: PartyRegistry) -> None:
+    task = asyncio.create_task(registry.run())
+    await asyncio.sleep(0.05)
+    task.cancel()
+    await asyncio.gather(task, return_exceptions=True)
+
+
+@pytest.mark.asyncio
+async def test_transient_failures_reopen_the_stream(monkeypatch):
+    registry = PartyRegistry()
+    polled = []
+    monkeypatch.setattr(registry, "_poll", lambda: polled.append(True))
+    watch = failing_stream(
+        errors.OperationFailure("not primary", code=10107),
+        ValueError("bad document"),
+    )
+    monkeypatch.setattr(party_registry, "watch_party_changes", watch)
+
+    await run_briefly(registry)
+
+    assert not polled
+    assert watch.opened == [True]
+    assert "p1" in registry
+
+
+@pytest.mark.asyncio
+async def test_servers_without_change_streams_are_polled(monkeypatch):
+    registry = PartyRegistry()
+    polled = []
+
+    async def poll():
+        polled.append(True)
+        await asyncio.Event().wait()
+
+    monkeypatch.setattr(registry, "_poll", poll)
+    monkeypatch.setattr(
+        party_registry,
+        "watch_party_changes",
+        failing_stream(
+            errors.OperationFailure(
+                "only supported on replica sets",
+                code=party_registry.CHANGE_STREAMS_UNSUPPORTED,
+            )
+        ),
+    )
+
+    await run_briefly(registry)
+
+    assert polled == [True]
+
+
+def document(party_id: str, users: tuple = (), genres: tuple = ("rock",)) -> dict:
+    return {
+        "_id": party_id,
+        "party_info": {
+            "owner": "owner",
+            "users": list(users),
+            "type": "public",
+            "genres": list(genres),
+        },
+    }
+
+
+def recording_registry() -> tuple[PartyRegistry, list]:
+    registry = PartyRegistry()
+    events = []
+    registry.add_listener(
+        lambda party_id, previous, record: events.append(
+            (
+                party_id,
+                previous and previous.users,
+                record and record.users,
+            )
+        )
+    )
+    return registry, events
+
+
+def test_change_events_are_applied():
+    registry, events = recording_registry()
+    insert = document("p1")
+    update = document("p1", users=("u1",))
+
+    registry.apply_change(
+        {
+            "operationType": "insert",
+            "documentKey": {"_id": "p1"},
+            "fullDocument": {"party_info": insert["party_info"]},
+        }
+    )
+    registry.apply_change(
+        {
+            "operationType": "update",
+            "documentKey": {"_id": "p1"},
+            "fullDocument": {"party_info": update["party_info"]},
+        }
+    )
+    assert registry.get("p1").users == ("u1",)
+
+    registry.apply_change({"operationType": "delete", "documentKey": {"_id": "p1"}})
+    assert "p1" not in registry
+
+    assert events == [("p1", None, ()), ("p1", (), ("u1",)), ("p1", ("u1",), None)]
+
+
+def test_updates_without_a_full_document_drop_the_party():
+    registry, events = recording_registry()
+    registry.upsert(document("p1"))
+
+    registry.apply_change(
+        {"operationType": "update", "documentKey": {"_id": "p1"}, "fullDocument": None}
+    )
+
+    assert "p1" not in registry
+    assert events[-1] == ("p1", (), None)
+
+
+def test_replace_all_adds_updates_and_removes_records():
+    registry, events = recording_registry()
+    registry.replace_all([document("kept"), document("changed"), document("gone")])
+    events.clear()
+
+    registry.replace_all(
+        [document("kept"), document("changed", ("u1",)), document("new")]
+    )
+
+    assert sorted(registry.keys()) == ["changed", "kept", "new"]
+    assert events == [
+        ("gone", (), None),
+        ("changed", (), ("u1",)),
+        ("new", None, ()),
+    ]
+
+
+def test_listeners_do_not_fire_for_unchanged_records():
+    registry, events = recording_registry()
+    registry.upsert(document("p1"))
+    events.clear()
+
+    registry.upsert(document("p1"))
+    registry.apply_change(
+        {
+            "operationType": "update",
+            "documentKey": {"_id": "p1"},
+            "fullDocument": {"party_info": document("p1")["party_info"]},
+        }
+    )
+
+    assert events == []
+
+
+def test_new_listeners_receive_every_existing_party():
+    registry = PartyRegistry()
+    registry.upsert(document("p1"))
+    events = []
+
+    registry.add_listener(lambda *event: events.append(event))
+
+    assert events == [("p1", None, registry.get("p1"))]
@@ -0,0 +1,28 @@
+from SpartyTime.backend.utils import party_handler
+from SpartyTime.backend.utils.party_scheduler import PartyScheduler, worker_stats
+from SpartyTime.backend.utils.sync_engine import sync_engine
+
+
+def test_worker_stats_cover_every_reported_component():
+    stats = worker_stats()
+
+    assert {"requests", "pool_size", "throttled", "queue_depth"} <= set(
+        stats["spotify"]
+    )
+    assert "last_tick_duration" in stats["sync"]
+    assert "hit_rate" in stats["catalog_cache"]["artists"]
+    assert "saved" in stats["coalescing"]["queue"]
+    assert "hit_rate" in stats["user_cache"]
+    assert "hit_rate" in stats["discovery_cache"]
+
+
+def test_dropped_parties_release_their_per_party_state():
+    scheduler = PartyScheduler()
+    party_handler.queue_fetched_at["gone"] = 1.0
+    sync_engine._party_limit("gone")
+
+    scheduler.schedule("gone")
+    assert scheduler._pop_due() == []
+
+    assert "gone" not in party_handler.queue_fetched_at
+    assert "gone" not in sync_engine._party_limits
@@ -0,0 +1,110 @@
+import asyncio
+import time
+from email.utils import formatdate
+
+import pytest
+
+from SpartyTime.backend.utils.spotify_client import (
+    PRIORITY_PLAYBACK,
+    SPOTIFY_API_URL,
+    SPOTIFY_RATE_BURST,
+    SPOTIFY_RATE_LIMIT,
+    RateLimiter,
+    RequestTiming,
+    SpotifyClient,
+    parse_retry_after,
+)
+
+
+def test_retry_after_in_seconds():
+    assert parse_retry_after("3") == 3
+    assert parse_retry_after("-1") == 0
+
+
+def test_retry_after_as_http_date():
+    delay = parse_retry_after(formatdate(time.time() + 30, usegmt=True))
+    assert 28 <= delay <= 30
+
+
+def test_missing_or_malformed_retry_after_falls_back_to_default():
+    assert parse_retry_after(None) == 1
+    assert parse_retry_after("soon") == 1
+
+
+class FakeResponse:
+    def __init__(self, status: int, headers: dict = None):
+        self.status = status
+        self.headers = headers or {}
+
+    def release(self):
+        pass
+
+
+class FakeSession:
+    """Session answering with the given responses after a fixed latency."""
+
+    def __init__(self, *responses: FakeResponse, latency: float = 0.01):
+        self.responses = list(responses)
+        self.latency = latency
+
+    async def request(self, method, url, **kwargs):
+        await asyncio.sleep(self.latency)
+        return self.responses.pop(0)
+
+
+@pytest.mark.asyncio
+async def test_timing_covers_only_the_exchange_that_answered():
+    client = SpotifyClient()
+    client.session = FakeSession(
+        FakeResponse(429, {"Retry-After": "0.1"}), FakeResponse(200)
+    )
+    client.rate_limiter.pause(0.1)
+    timing = RequestTiming()
+
+    start = time.monotonic()
+    async with client.request("GET", f"{SPOTIFY_API_URL}v1/me", timing=timing):
+        pass
+
+    assert time.monotonic() - start >= 0.2
+    assert timing.sent_at - start >= 0.2
+    assert timing.received_at - timing.sent_at < 0.05
+
+
+@pytest.mark.asyncio
+async def test_waiters_are_released_in_priority_order():
+    limiter = RateLimiter(rate=200, burst=1)
+    limiter.tokens = 0
+    released = []
+
+    async def acquire(priority):
+        await limiter.acquire(priority)
+        released.append(priority)
+
+    await asyncio.gather(*[acquire(i) for i in (3, 1, 2, 0)])
+
+    assert released == [0, 1, 2, 3]
+
+
+@pytest.mark.asyncio
+async def test_pause_holds_back_every_priority():
+    limiter = RateLimiter(rate=100, burst=10)
+    limiter.pause(0.1)
+    assert limiter.throttled == 1
+
+    start = time.monotonic()
+    await limiter.acquire(PRIORITY_PLAYBACK)
+
+    assert time.monotonic() - start >= 0.1
+
+
+def test_share_splits_rate_and_burst_between_workers():
+    limiter = RateLimiter()
+
+    limiter.share(4)
+
+    assert limiter.rate == SPOTIFY_RATE_LIMIT / 4
+    assert limiter.burst == max(SPOTIFY_RATE_BURST / 4, 1)
+    assert limiter.tokens <= limiter.burst
+
+    limiter.share(0)
+    assert limiter.rate == SPOTIFY_RATE_LIMIT
@@ -0,0 +1,23 @@
+import pytest
+
+from SpartyTime.backend.utils.spotify_handler import read_json
+
+
+class FakeResponse:
+    def __init__(self, body: bytes):
+        self.body = body
+
+    async def read(self) -> bytes:
+        return self.body
+
+
+@pytest.mark.asyncio
+async def test_read_json_decodes_the_raw_body():
+    assert await read_json(FakeResponse(b'{"is_playing": true}')) == {
+        "is_playing": True
+    }
+
+
+@pytest.mark.asyncio
+async def test_read_json_answers_an_empty_body_with_none():
+    assert await read_json(FakeResponse(b"")) is None
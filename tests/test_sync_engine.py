@@ -0,0 +1,24 @@
+import pytest
+
+from SpartyTime.backend.utils.sync_engine import SyncEngine
+
+
+async def call():
+    return 1
+
+
+@pytest.mark.asyncio
+async def test_tick_records_the_calls_of_its_party():
+    engine = SyncEngine()
+    await engine.run("a", call)
+    await engine.run("b", call)
+    await engine.run("a", call)
+
+    engine.record_tick("a", 0.25)
+    assert engine.stats()["last_tick_duration"] == 0.25
+    assert engine.stats()["last_tick_calls"] == 2
+
+    engine.record_tick("b", 0.5)
+    assert engine.stats()["last_tick_calls"] == 1
+    engine.record_tick("a", 0.1)
+    assert engine.stats()["last_tick_calls"] == 0
@@ -0,0 +1,108 @@
+import asyncio
+import itertools
+import time
+from contextlib import asynccontextmanager
+
+import pytest
+
+from SpartyTime.backend.utils import token_manager as token_module
+from SpartyTime.backend.utils.database_handler import SpotifySessionModel
+from SpartyTime.backend.utils.token_manager import (
+    TOKEN_IDLE_TIMEOUT,
+    TOKEN_REFRESH_MARGIN,
+    TokenManager,
+)
+
+
+def session(access_token: str, expires_in: float = 3600) -> SpotifySessionModel:
+    return SpotifySessionModel(
+        access_token=access_token,
+        token_type="Bearer",
+        expires_in=3600,
+        scope="",
+        refresh_token="refresh",
+        expires_at=round(time.time() + expires_in),
+    )
+
+
+class FakeResponse:
+    def __init__(self, body: dict):
+        self.body = body
+
+    async def json(self):
+        return self.body
+
+
+@pytest.fixture
+def accounts(monkeypatch):
+    """Stub the Spotify accounts service, handing out token-1, token-2, ..."""
+    requests = []
+    tokens = itertools.count(1)
+
+    @asynccontextmanager
+    async def request(method, url, **kwargs):
+        requests.append(url)
+        await asyncio.sleep(0.01)
+        yield FakeResponse(
+            {
+                "access_token": f"token-{next(tokens)}",
+                "token_type": "Bearer",
+                "expires_in": 3600,
+                "scope": "",
+            }
+        )
+
+    async def update_session(user_id, data):
+        return True
+
+    monkeypatch.setattr(token_module.spotify_client, "request", request)
+    monkeypatch.setattr(token_module, "update_session", update_session)
+    return requests
+
+
+@pytest.mark.asyncio
+async def test_concurrent_refreshes_share_one_request(accounts):
+    manager = TokenManager()
+    manager.remember("u1", session("old"))
+
+    results = await asyncio.gather(*[manager.refresh("u1") for _ in range(5)])
+
+    assert len(accounts) == 1
+    assert {i.access_token for i in results} == {"token-1"}
+    assert manager.refreshes == 1
+
+
+@pytest.mark.asyncio
+async def test_rotated_token_resolves_to_the_current_one(accounts):
+    manager = TokenManager()
+    manager.remember("u1", session("old"))
+    await manager.refresh("u1")
+
+    assert await manager.refresh_for_token("old") == "token-1"
+    assert len(accounts) == 1
+
+
+@pytest.mark.asyncio
+async def test_get_token_refreshes_within_the_margin(accounts):
+    manager = TokenManager()
+    manager.remember("fresh", session("fresh-token"))
+    manager.remember("expiring", session("old", TOKEN_REFRESH_MARGIN - 10))
+
+    assert await manager.get_token("fresh") == "fresh-token"
+    assert await manager.get_token("expiring") == "token-1"
+    assert len(accounts) == 1
+
+
+@pytest.mark.asyncio
+async def test_evict_idle_keeps_active_users():
+    manager = TokenManager()
+    idle_since = time.monotonic() - TOKEN_IDLE_TIMEOUT - 1
+    for user_id in ("active", "idle", "recent"):
+        manager.remember(user_id, session(f"{user_id}-token"))
+        manager._used_at[user_id] = idle_since
+    manager._used_at["recent"] = time.monotonic()
+
+    manager.evict_idle({"active"})
+
+    assert set(manager._sessions) == {"active", "recent"}
+    assert "idle-token" not in manager._owners
@@ -0,0 +1,60 @@
+import asyncio
+
+import pytest
+from pymongo import UpdateOne
+
+from SpartyTime.backend.utils.write_buffer import WriteBuffer
+
+
+@pytest.mark.asyncio
+async def test_cancelled_waiter_does_not_break_pending_writes(mongo):
+    buffer = WriteBuffer()
+    collection = mongo["parties"].party_details
+    await collection.insert_one({"_id": 1, "n": 0})
+    buffer.add(collection, UpdateOne({"_id": 1}, {"$inc": {"n": 1}}))
+    pending = buffer.pending()
+
+    async def wait():
+        await asyncio.shield(pending)
+
+    waiters = [asyncio.create_task(wait()) for _ in range(2)]
+    await asyncio.sleep(0)
+    waiters[0].cancel()
+
+    assert await buffer.flush() == 0
+    assert await waiters[1] is None
+    assert pending.done() and not pending.cancelled()
+    assert (await collection.find_one({"_id": 1}))["n"] == 1
+
+
+@pytest.mark.asyncio
+async def test_flush_survives_a_cancelled_pending_future(mongo):
+    buffer = WriteBuffer()
+    collection = mongo["parties"].party_details
+    buffer.add(collection, UpdateOne({"_id": 1}, {"$set": {"n": 1}}, upsert=True))
+    buffer.pending().cancel()
+
+    assert await buffer.flush() == 0
+    assert buffer.pending().done()
+
+
+@pytest.mark.asyncio
+async def test_failing_callback_does_not_stop_the_others(mongo):
+    buffer = WriteBuffer()
+    collection = mongo["parties"].party_details
+    flushed = []
+
+    def fail():
+        raise RuntimeError("callback failed")
+
+    buffer.add(collection, UpdateOne({"_id": 1}, {"$set": {"n": 1}}, upsert=True), fail)
+    buffer.add(
+        collection,
+        UpdateOne({"_id": 2}, {"$set": {"n": 1}}, upsert=True),
+        lambda: flushed.append(2),
+    )
+    pending = buffer.pending()
+
+    assert await buffer.flush() == 0
+    assert flushed == [2]
+    assert pending.done()